@@ -1,19 +1,31 @@
 #!/usr/bin/env python3
 import csv
+import itertools
+import os
 import re
 import socket
+import sqlite3
+import time
+import asyncio
+import dns.asyncresolver
 import dns.resolver
 import argparse
 from pathlib import Path
 
+try:
+    import aiodns  # c-ares: answers parsed in C
+except ImportError:
+    aiodns = None
+
 # --------------------
 # CONFIG
 # --------------------
-LEGAL_SUFFIXES = [
-    r"\bPTY\b", r"\bPTY LTD\b", r"\bLIMITED\b", r"\bLTD\b",
-    r"\bPROPRIETARY\b", r"\bPROPRIETARY LIMITED\b",
-    r"\bGROUP\b", r"\bHOLDINGS?\b", r"\bAUSTRALIA\b"
-]
+# single precompiled alternation (longest forms first)
+_SUFFIX_RE = re.compile(
+    r"\b(?:PTY\s+LTD|PROPRIETARY\s+LIMITED|PTY|PROPRIETARY|LIMITED|LTD|HOLDINGS?|GROUP|AUSTRALIA)\b"
+)
+_NONALNUM_RE = re.compile(r"[^A-Z0-9 ]")
+_WS_RE = re.compile(r"\s+")
 
 EMAIL_PREFIXES_AU = [
     "info", "contact", "hello", "enquiries", "enquiry",
@@ -24,15 +36,101 @@ DOMAIN_SUFFIXES_AU = [
     ".com.au", ".net.au", ".org.au", ".com"
 ]
 
+# MX lookups run concurrently (bounded); short lifetime keeps tail latency down
+DNS_CONCURRENCY = 64
+DNS_LIFETIME = 2.0
+
+# rows read / resolved / written per chunk (the CSV is never loaded whole)
+CHUNK_SIZE = 1000
+
+# point this at a local caching resolver (e.g. RESOLVER_IP=127.0.0.1 for unbound)
+RESOLVER_IP = os.environ.get("RESOLVER_IP", "")
+NAMESERVERS = [ip.strip() for ip in RESOLVER_IP.split(",") if ip.strip()]
+DNS_CACHE_SIZE = 10_000
+
+# "dnspython" (default) or "aiodns": keep whichever benchmarks faster on the target box
+MX_BACKEND = os.environ.get("MX_BACKEND", "dnspython")
+if aiodns is None:
+    MX_BACKEND = "dnspython"
+
+# confirmed-dead domains (NXDOMAIN / no MX), kept across runs: skipped without any DNS query.
+# Stored as negative entries (empty mx) in the same sqlite MX cache as the v2 script,
+# and forgotten after MX_DEAD_TTL so a domain registered since gets checked again.
+MX_CACHE_DB = os.environ.get("MX_CACHE_DB", "/tmp/sysiphe_mx_cache.sqlite")
+MX_DEAD_TTL = int(os.environ.get("MX_DEAD_TTL", str(7 * 86400)))
+
+_aio_resolver = None
+_mx_db = None
+
+def mx_cache_db() -> sqlite3.Connection:
+    global _mx_db
+    if _mx_db is None:
+        _mx_db = sqlite3.connect(MX_CACHE_DB)
+        _mx_db.execute(
+            "CREATE TABLE IF NOT EXISTS mx_cache (domain TEXT PRIMARY KEY, mx TEXT, expires REAL)"
+        )
+    return _mx_db
+
+def load_dead_domains() -> set:
+    """Domains with an unexpired negative entry."""
+    rows = mx_cache_db().execute(
+        "SELECT domain FROM mx_cache WHERE mx = '' AND expires > ?", (time.time(),)
+    )
+    return {d for (d,) in rows}
+
+DEAD_DOMAINS = load_dead_domains()
+_new_dead = []
+
+def save_dead_domains():
+    """Record the domains found dead since the last call."""
+    if not _new_dead:
+        return
+    expires = time.time() + MX_DEAD_TTL
+    db = mx_cache_db()
+    db.executemany(
+        "INSERT OR REPLACE INTO mx_cache (domain, mx, expires) VALUES (?, '', ?)",
+        [(d, expires) for d in _new_dead],
+    )
+    db.commit()
+    _new_dead.clear()
+
+def _make_resolver():
+    resolver = dns.asyncresolver.Resolver()
+    resolver.lifetime = DNS_LIFETIME
+    if NAMESERVERS:
+        resolver.nameservers = NAMESERVERS
+    # in-process cache on top of the local resolver's cache
+    resolver.cache = dns.resolver.LRUCache(DNS_CACHE_SIZE)
+    return resolver
+
+RESOLVER = _make_resolver()
+
+def aiodns_resolver():
+    """aiodns resolver bound to the running loop (asyncio.run() makes a new one per chunk)."""
+    global _aio_resolver
+    loop = asyncio.get_running_loop()
+    if _aio_resolver is None or _aio_resolver[0] is not loop:
+        resolver = aiodns.DNSResolver(
+            nameservers=NAMESERVERS or None, loop=loop, timeout=DNS_LIFETIME, tries=1
+        )
+        _aio_resolver = (loop, resolver)
+    return _aio_resolver[1]
+
+async def aiodns_mx_count(domain: str) -> int:
+    """Number of MX records, via query_dns on aiodns >= 4 (query() is deprecated there)."""
+    resolver = aiodns_resolver()
+    if hasattr(resolver, "query_dns"):
+        res = await resolver.query_dns(domain, "MX")
+        return sum(1 for r in res.answer if hasattr(r.data, "exchange"))
+    return len(await resolver.query(domain, "MX"))
+
 # --------------------
 # UTILS
 # --------------------
 def normalize_name(name: str) -> str:
-    n = name.upper()
-    for suf in LEGAL_SUFFIXES:
-        n = re.sub(suf, "", n)
-    n = re.sub(r"[^A-Z0-9 ]", "", n)
-    n = re.sub(r"\s+", " ", n).strip()
+    n = _SUFFIX_RE.sub("", name.upper())
+    n = _NONALNUM_RE.sub("", n)
+    n = _WS_RE.sub(" ", n).strip()
     return n.lower()
 
 def generate_domain_candidates(base: str):
@@ -47,63 +145,96 @@ def generate_domain_candidates(base: str):
                 candidates.add(core + suf)
     return list(candidates)
 
-def has_mx(domain: str) -> bool:
-    try:
-        answers = dns.resolver.resolve(domain, 'MX')
-        return len(answers) > 0
-    except Exception:
+def is_dead_error(e: Exception) -> bool:
+    """NXDOMAIN / no MX record, as opposed to a timeout or SERVFAIL."""
+    if isinstance(e, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+        return True
+    return (aiodns is not None and isinstance(e, aiodns.error.DNSError) and bool(e.args)
+            and e.args[0] in (aiodns.error.ARES_ENOTFOUND, aiodns.error.ARES_ENODATA))
+
+async def has_mx(domain: str, sem: asyncio.Semaphore) -> bool:
+    if domain in DEAD_DOMAINS:
         return False
+    async with sem:
+        try:
+            if MX_BACKEND == "aiodns":
+                # only existence matters here: no need for full dnspython records
+                return await aiodns_mx_count(domain) > 0
+            answers = await RESOLVER.resolve(domain, 'MX')
+            return len(answers) > 0
+        except Exception as e:
+            # timeouts are not remembered: the domain may well be alive
+            if is_dead_error(e):
+                DEAD_DOMAINS.add(domain)
+                _new_dead.append(domain)
+            return False
 
 def generate_emails(domain: str):
     return [f"{p}@{domain}" for p in EMAIL_PREFIXES_AU]
 
-# --------------------
-# MAIN
-# --------------------
-def main(input_csv: Path, output_csv: Path, limit: int):
-    rows = []
-
-    with open(input_csv, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows.append(r)
-            if limit and len(rows) >= limit:
-                break
-
-    print(f"[+] Loaded {len(rows)} rows")
-
-    results = []
+async def run(rows):
+    sem = asyncio.Semaphore(DNS_CONCURRENCY)
 
+    prepared = []
     for r in rows:
         legal_name = r.get("legal_name") or r.get("business_name") or ""
         if not legal_name.strip():
             continue
+        prepared.append((r, legal_name, generate_domain_candidates(normalize_name(legal_name))))
 
-        norm = normalize_name(legal_name)
-        domains = generate_domain_candidates(norm)
+    # one MX lookup per unique domain across the whole batch
+    unique = list(dict.fromkeys(dom for _, _, domains in prepared for dom in domains))
+    mx_ok = dict(zip(unique, await asyncio.gather(*(has_mx(dom, sem) for dom in unique))))
 
+    results = []
+    for r, legal_name, domains in prepared:
         for dom in domains:
-            if has_mx(dom):
-                emails = generate_emails(dom)
-                for email in emails:
-                    results.append({
-                        "abn": r.get("abn", ""),
-                        "legal_name": legal_name,
-                        "guessed_domain": dom,
-                        "email": email,
-                        "method": "guess_mx"
-                    })
+            if mx_ok[dom]:
+                results.extend({
+                    "abn": r.get("abn", ""),
+                    "legal_name": legal_name,
+                    "guessed_domain": dom,
+                    "email": email,
+                    "method": "guess_mx"
+                } for email in generate_emails(dom))
                 break  # one domain with MX is enough
+    return results
+
+# --------------------
+# MAIN
+# --------------------
+def read_chunks(input_csv: Path, limit: int, size: int = CHUNK_SIZE):
+    """Stream the CSV in chunks of `size` rows (at most `limit` rows in total)."""
+    with open(input_csv, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if limit:
+            reader = itertools.islice(reader, limit)
+        while True:
+            chunk = list(itertools.islice(reader, size))
+            if not chunk:
+                return
+            yield chunk
 
-    print(f"[+] Generated {len(results)} email candidates")
+def main(input_csv: Path, output_csv: Path, limit: int):
+    loaded = 0
+    generated = 0
 
     with open(output_csv, "w", newline="", encoding="utf-8") as f:
         fieldnames = ["abn", "legal_name", "guessed_domain", "email", "method"]
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
-        for r in results:
-            writer.writerow(r)
 
+        # each chunk is resolved and written right away: memory bounded by CHUNK_SIZE
+        for rows in read_chunks(input_csv, limit):
+            loaded += len(rows)
+            print(f"[+] Loaded {loaded} rows")
+
+            results = asyncio.run(run(rows))
+            writer.writerows(results)
+            generated += len(results)
+            save_dead_domains()
+
+    print(f"[+] Generated {generated} email candidates")
     print(f"[✓] Output written to {output_csv}")
 
 if __name__ == "__main__":
@@ -1,19 +1,32 @@
 #!/usr/bin/env python3
 import csv
+import itertools
+import os
 import re
+import time
+import sqlite3
 import argparse
+import asyncio
 from pathlib import Path
+import dns.asyncresolver
 import dns.resolver
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiodns  # c-ares : parsing des réponses en C
+except ImportError:
+    aiodns = None
 
 # --------------------
 # CONFIG
 # --------------------
-LEGAL_SUFFIXES = [
-    r"\bPTY\b", r"\bPTY LTD\b", r"\bLIMITED\b", r"\bLTD\b",
-    r"\bPROPRIETARY\b", r"\bPROPRIETARY LIMITED\b",
-    r"\bGROUP\b", r"\bHOLDINGS?\b", r"\bAUSTRALIA\b"
-]
+# une seule alternation précompilée (formes longues d'abord)
+_SUFFIX_RE = re.compile(
+    r"\b(?:PTY\s+LTD|PROPRIETARY\s+LIMITED|PTY|PROPRIETARY|LIMITED|LTD|HOLDINGS?|GROUP|AUSTRALIA)\b"
+)
+_NONALNUM_RE = re.compile(r"[^A-Z0-9 ]")
+_WS_RE = re.compile(r"\s+")
 
 # AU: enquiries/enquiry très courant
 PREFERRED_PREFIXES_AU = [
@@ -28,13 +41,63 @@ GENERIC_TOKENS = {"insurance", "steel", "hardware", "investments", "finance", "s
 USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) Sysiphe/1.0"
 HTTP_TIMEOUT = 6
 
+# lookups MX en parallèle (borné) ; lifetime court pour éviter que la queue domine le batch
+DNS_CONCURRENCY = 64
+DNS_LIFETIME = 2.0
+
+# lignes lues / résolues / écrites par paquet (le CSV n'est jamais chargé en entier)
+CHUNK_SIZE = 1000
+
+# résolveur local avec cache conseillé (ex: RESOLVER_IP=127.0.0.1 pour unbound)
+RESOLVER_IP = os.environ.get("RESOLVER_IP", "")
+NAMESERVERS = [ip.strip() for ip in RESOLVER_IP.split(",") if ip.strip()]
+DNS_CACHE_SIZE = 10_000
+
+# "dnspython" (défaut) ou "aiodns" : garder celui qui gagne au bench sur la machine cible
+MX_BACKEND = os.environ.get("MX_BACKEND", "dnspython")
+if aiodns is None:
+    MX_BACKEND = "dnspython"
+
+# cache MX persistant entre les runs (TTL = TTL de l'enregistrement)
+MX_CACHE_DB = os.environ.get("MX_CACHE_DB", "/tmp/sysiphe_mx_cache.sqlite")
+# au-delà, une entrée expirée n'est plus servie en "stale"
+MX_STALE_MAX = 7 * 86400
+# domaines morts (NXDOMAIN / pas de MX) : mémorisés pour ne plus les interroger
+MX_DEAD_TTL = int(os.environ.get("MX_DEAD_TTL", str(7 * 86400)))
+
+_mx_db = None
+_mx_refreshing = set()
+_aio_resolver = None
+
+
+class NoMX(Exception):
+    """Le domaine n'existe pas ou n'a pas d'enregistrement MX."""
+
+
+def _make_resolver():
+    resolver = dns.asyncresolver.Resolver()
+    resolver.lifetime = DNS_LIFETIME
+    if NAMESERVERS:
+        resolver.nameservers = NAMESERVERS
+    # cache en mémoire, en plus du cache du résolveur local
+    resolver.cache = dns.resolver.LRUCache(DNS_CACHE_SIZE)
+    return resolver
+
+
+RESOLVER = _make_resolver()
+
+# une seule session : keep-alive + pool de connexions (pas de handshake TLS par requête)
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": USER_AGENT})
+_adapter = HTTPAdapter(pool_connections=64, pool_maxsize=DNS_CONCURRENCY)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
 
 def normalize_name(name: str) -> str:
-    n = name.upper()
-    for suf in LEGAL_SUFFIXES:
-        n = re.sub(suf, "", n)
-    n = re.sub(r"[^A-Z0-9 ]", "", n)
-    n = re.sub(r"\s+", " ", n).strip()
+    n = _SUFFIX_RE.sub("", name.upper())
+    n = _NONALNUM_RE.sub("", n)
+    n = _WS_RE.sub(" ", n).strip()
     return n.lower()
 
 
@@ -79,10 +142,113 @@ def domain_candidates(cores):
     return out
 
 
-def mx_hosts(domain: str):
+def mx_cache_db() -> sqlite3.Connection:
+    global _mx_db
+    if _mx_db is None:
+        _mx_db = sqlite3.connect(MX_CACHE_DB)
+        _mx_db.execute(
+            "CREATE TABLE IF NOT EXISTS mx_cache (domain TEXT PRIMARY KEY, mx TEXT, expires REAL)"
+        )
+    return _mx_db
+
+
+def aiodns_resolver():
+    """
+    Résolveur aiodns lié à la boucle courante
+    (asyncio.run() crée une nouvelle boucle à chaque paquet).
+    """
+    global _aio_resolver
+    loop = asyncio.get_running_loop()
+    if _aio_resolver is None or _aio_resolver[0] is not loop:
+        resolver = aiodns.DNSResolver(
+            nameservers=NAMESERVERS or None, loop=loop, timeout=DNS_LIFETIME, tries=1
+        )
+        _aio_resolver = (loop, resolver)
+    return _aio_resolver[1]
+
+
+async def aiodns_mx(domain: str):
+    """
+    MX via aiodns : liste de (hôte, ttl). query_dns (aiodns >= 4, résultat pycares
+    natif) quand il existe ; query, déprécié depuis, sur les versions plus anciennes.
+    """
+    resolver = aiodns_resolver()
+    if hasattr(resolver, "query_dns"):
+        res = await resolver.query_dns(domain, "MX")
+        return [(r.data.exchange, r.ttl) for r in res.answer if hasattr(r.data, "exchange")]
+    return [(r.host, r.ttl) for r in await resolver.query(domain, "MX")]
+
+
+async def resolve_mx(domain: str):
+    """
+    Retourne (liste des MX, ttl). Lève NoMX si NXDOMAIN / pas de MX,
+    l'exception d'origine pour le reste (timeout, SERVFAIL...).
+    """
+    if MX_BACKEND == "aiodns":
+        try:
+            res = await aiodns_mx(domain)
+        except aiodns.error.DNSError as e:
+            if e.args and e.args[0] in (aiodns.error.ARES_ENOTFOUND, aiodns.error.ARES_ENODATA):
+                raise NoMX(domain) from e
+            raise
+        if not res:
+            raise NoMX(domain)
+        return [host.rstrip(".").lower() for host, _ in res], min(ttl for _, ttl in res)
+
+    try:
+        answers = await RESOLVER.resolve(domain, "MX")
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        raise NoMX(domain) from e
+    return [str(r.exchange).rstrip(".").lower() for r in answers], answers.rrset.ttl
+
+
+async def lookup_mx(domain: str, sem: asyncio.Semaphore):
+    """
+    Résolution MX brute : retourne la liste des MX ([] si domaine mort)
+    et met le cache à jour. Lève l'exception DNS en cas d'échec (timeout...).
+    """
+    async with sem:
+        try:
+            mx_list, ttl = await resolve_mx(domain)
+        except NoMX:
+            # entrée négative (mx vide) : le domaine est sauté jusqu'à expiration
+            mx_list, ttl = [], MX_DEAD_TTL
+    mx_cache_db().execute(
+        "INSERT OR REPLACE INTO mx_cache (domain, mx, expires) VALUES (?, ?, ?)",
+        (domain, ";".join(mx_list), time.time() + ttl),
+    )
+    return mx_list
+
+
+async def refresh_mx(domain: str, sem: asyncio.Semaphore):
+    # un domaine qui a perdu ses MX est réécrit en entrée négative par lookup_mx
+    try:
+        await lookup_mx(domain, sem)
+    except Exception:
+        pass
+
+
+async def mx_hosts(domain: str, sem: asyncio.Semaphore):
+    """
+    MX via le cache sqlite.
+    Entrée expirée : on sert la valeur périmée tout de suite et on rafraîchit
+    en tâche de fond (serve-stale, RFC 8767).
+    Les domaines morts sont aussi en cache (mx vide) : pas de requête DNS.
+    """
+    row = mx_cache_db().execute(
+        "SELECT mx, expires FROM mx_cache WHERE domain=?", (domain,)
+    ).fetchone()
+    now = time.time()
+    if row and row[1] + MX_STALE_MAX > now:
+        mx, expires = row
+        if expires <= now:
+            task = asyncio.create_task(refresh_mx(domain, sem))
+            _mx_refreshing.add(task)
+            task.add_done_callback(_mx_refreshing.discard)
+        return mx.split(";") if mx else []
+
     try:
-        answers = dns.resolver.resolve(domain, "MX")
-        return [str(r.exchange).rstrip(".").lower() for r in answers]
+        return await lookup_mx(domain, sem)
     except Exception:
         return []
 
@@ -103,7 +269,7 @@ def site_responds(domain: str) -> bool:
     for scheme in ("https://", "http://"):
         url = scheme + domain
         try:
-            r = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=HTTP_TIMEOUT, allow_redirects=True)
+            r = SESSION.get(url, timeout=HTTP_TIMEOUT, allow_redirects=True)
             if r.status_code < 500:
                 return True
         except Exception:
@@ -144,89 +310,132 @@ def confidence_score(domain: str, norm_name: str, mx_list, site_ok: bool) -> int
     return min(score, 100)
 
 
-def main(input_csv: Path, output_csv: Path, limit: int):
-    rows = []
-    with open(input_csv, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows.append(r)
-            if limit and len(rows) >= limit:
-                break
+def prepare_row(r):
+    """
+    Retourne (ligne, legal_name, nom affiché, nom normalisé, domaines candidats)
+    ou None si la ligne n'est pas exploitable.
+    """
+    legal_name = (r.get("legal_name") or "").strip()
+    business_name = (r.get("business_name") or "").strip()
+    name = business_name or legal_name
+    if not name:
+        return None
 
-    print(f"[+] Loaded {len(rows)} rows")
+    norm = normalize_name(name)
+    cores = domain_core_candidates(norm)
+    if not cores:
+        return None
 
-    results = []
-    tested = 0
-    kept = 0
+    return r, legal_name, name, norm, domain_candidates(cores)
 
-    for r in rows:
-        legal_name = (r.get("legal_name") or "").strip()
-        business_name = (r.get("business_name") or "").strip()
-        name = business_name or legal_name
-        if not name:
-            continue
 
-        norm = normalize_name(name)
-        cores = domain_core_candidates(norm)
-        if not cores:
+def best_candidate(prepared, mx_by_domain, site_by_domain):
+    r, legal_name, name, norm, candidates = prepared
+    best = None
+
+    for dom in candidates:
+        mx_list = mx_by_domain[dom]
+        # pas de MX, ou MX “suspect” (voir is_obvious_sink)
+        if dom not in site_by_domain:
             continue
 
-        candidates = domain_candidates(cores)
-
-        best = None
-
-        for dom in candidates:
-            tested += 1
-            mx_list = mx_hosts(dom)
-            if not mx_list:
-                continue
-
-            # Optionnel : filtrer des MX “suspects” (ici on garde)
-            if is_obvious_sink(mx_list):
-                continue
-
-            site_ok = site_responds(dom)
-            # si pas de site, on peut quand même garder mais score plus faible.
-            score = confidence_score(dom, norm, mx_list, site_ok)
-
-            # on garde le meilleur domaine trouvé
-            if best is None or score > best["confidence"]:
-                best = {
-                    "abn": r.get("abn", ""),
-                    "legal_name": legal_name,
-                    "display_name": name,
-                    "guessed_domain": dom,
-                    "email": best_email(dom),
-                    "confidence": score,
-                    "site_ok": "yes" if site_ok else "no",
-                    "mx": ";".join(mx_list[:3]),
-                    "method": "guess_mx_http"
-                }
-
-        if best:
-            results.append(best)
-            kept += 1
+        site_ok = site_by_domain[dom]
+        # si pas de site, on peut quand même garder mais score plus faible.
+        score = confidence_score(dom, norm, mx_list, site_ok)
 
-    print(f"[+] Tested domains: {tested}")
-    print(f"[+] Kept companies: {kept}")
-    print(f"[+] Output rows: {len(results)}")
+        # on garde le meilleur domaine trouvé
+        if best is None or score > best["confidence"]:
+            best = {
+                "abn": r.get("abn", ""),
+                "legal_name": legal_name,
+                "display_name": name,
+                "guessed_domain": dom,
+                "email": best_email(dom),
+                "confidence": score,
+                "site_ok": "yes" if site_ok else "no",
+                "mx": ";".join(mx_list[:3]),
+                "method": "guess_mx_http"
+            }
+
+    return best
+
+
+async def run(rows):
+    """
+    Retourne [(nb domaines testés, meilleur candidat ou None)] par ligne exploitable.
+    Les candidats sont dédupliqués sur tout le batch : un lookup MX (et un test HTTP)
+    par domaine unique, pas par ligne.
+    """
+    sem = asyncio.Semaphore(DNS_CONCURRENCY)
+    prepared = [p for p in map(prepare_row, rows) if p]
+
+    unique = list(dict.fromkeys(dom for p in prepared for dom in p[4]))
+    mx_lists = await asyncio.gather(*(mx_hosts(dom, sem) for dom in unique))
+    mx_by_domain = dict(zip(unique, mx_lists))
+    print(f"[+] Unique domains resolved: {len(unique)}")
+
+    # Optionnel : filtrer des MX “suspects” (ici on garde)
+    live = [dom for dom in unique if mx_by_domain[dom] and not is_obvious_sink(mx_by_domain[dom])]
+    # requests est bloquant : on le sort de la boucle d'événements
+    site_oks = await asyncio.gather(*(asyncio.to_thread(site_responds, dom) for dom in live))
+    site_by_domain = dict(zip(live, site_oks))
+
+    # laisse finir les rafraîchissements serve-stale avant de persister
+    await asyncio.gather(*_mx_refreshing)
+    mx_cache_db().commit()
+
+    return [(len(p[4]), best_candidate(p, mx_by_domain, site_by_domain)) for p in prepared]
+
+
+def read_chunks(input_csv: Path, limit: int, size: int = CHUNK_SIZE):
+    """
+    Lit le CSV en flux, par paquets de `size` lignes (au plus `limit` au total).
+    """
+    with open(input_csv, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if limit:
+            reader = itertools.islice(reader, limit)
+        while True:
+            chunk = list(itertools.islice(reader, size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def main(input_csv: Path, output_csv: Path, limit: int):
+    loaded = 0
+    tested = 0
+    kept = 0
 
     with open(output_csv, "w", newline="", encoding="utf-8") as f:
         fieldnames = ["email", "company_name", "abn", "guessed_domain", "confidence", "site_ok", "mx", "method"]
         w = csv.DictWriter(f, fieldnames=fieldnames)
         w.writeheader()
-        for x in results:
-            w.writerow({
-                "email": x["email"],
-                "company_name": x["display_name"],
-                "abn": x["abn"],
-                "guessed_domain": x["guessed_domain"],
-                "confidence": x["confidence"],
-                "site_ok": x["site_ok"],
-                "mx": x["mx"],
-                "method": x["method"]
-            })
 
+        # chaque paquet est résolu puis écrit aussitôt : mémoire bornée par CHUNK_SIZE
+        for rows in read_chunks(input_csv, limit):
+            loaded += len(rows)
+            print(f"[+] Loaded {loaded} rows")
+
+            for n_tested, x in asyncio.run(run(rows)):
+                tested += n_tested
+                if not x:
+                    continue
+                kept += 1
+                w.writerow({
+                    "email": x["email"],
+                    "company_name": x["display_name"],
+                    "abn": x["abn"],
+                    "guessed_domain": x["guessed_domain"],
+                    "confidence": x["confidence"],
+                    "site_ok": x["site_ok"],
+                    "mx": x["mx"],
+                    "method": x["method"]
+                })
+
+    print(f"[+] Tested domains: {tested}")
+    print(f"[+] Kept companies: {kept}")
+    print(f"[+] Output rows: {kept}")
     print(f"[✓] Wrote {output_csv}")
 
 
@@ -1,17 +1,34 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse, csv, re, time, random
+import argparse, csv, itertools, re, time, random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urlparse
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
-EMAIL_RE = re.compile(r"\b[a-zA-Z0-9._%+-]+@([a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}\b")
+try:
+    import re2 as email_re  # google-re2 : DFA, scan linéaire sur les gros HTML
+except ImportError:
+    email_re = re
+
+EMAIL_RE = email_re.compile(r"\b[a-zA-Z0-9._%+-]+@([a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}\b")
 BAD_EMAIL_HINTS = ("example.com", "yourcompany.com", "email.com", "test.com", "domain.com")
 CONTACT_PATHS = ("/contact", "/contact-us", "/about", "/about-us", "/support", "/enquiries")
+# une de ces adresses suffit : on n'attend pas les autres pages
+STRONG_PREFIXES = ("contact@", "info@")
+
+PAGE_POOL = ThreadPoolExecutor(max_workers=32)
 
 UA = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
 
+# une seule session : keep-alive + pool de connexions (pas de handshake TLS par requête)
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": UA})
+_adapter = HTTPAdapter(pool_connections=64, pool_maxsize=32)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
 def norm_domain(d: str) -> str:
     d = (d or "").strip().lower()
     d = d.replace("https://", "").replace("http://", "")
@@ -29,34 +46,54 @@ def extract_emails(text: str):
         out.append(e)
     return sorted(out)
 
+# rang de chaque préfixe (plus petit = meilleur), calculé une fois
+PREFIX_PRIORITY = {p: i for i, p in enumerate(
+    ("contact", "info", "hello", "enquiries", "enquiry", "sales", "support", "admin")
+)}
+
 def pick_best_email(emails):
     if not emails:
         return None
-    preferred = ("contact@", "info@", "hello@", "enquiries@", "enquiry@", "sales@", "support@", "admin@")
-    for p in preferred:
-        for e in emails:
-            if e.startswith(p):
-                return e
-    return emails[0]
+    # une seule passe ; à égalité l'ordre de la liste est conservé, préfixe inconnu => premier email
+    return min(emails, key=lambda e: PREFIX_PRIORITY.get(e.partition("@")[0], 99))
 
 def fetch(url, timeout):
     try:
-        r = requests.get(url, headers={"User-Agent": UA}, timeout=timeout, allow_redirects=True)
+        r = SESSION.get(url, timeout=timeout, allow_redirects=True)
         if r.status_code != 200:
             return None
         return r.text
     except Exception:
         return None
 
+def fetch_emails(url, timeout):
+    html = fetch(url, timeout)
+    return extract_emails(html) if html else []
+
 def verify_email_on_site(domain: str, timeout: int):
     base = "https://" + domain
-    for path in ("",) + CONTACT_PATHS:
-        url = base if path == "" else base.rstrip("/") + path
-        html = fetch(url, timeout)
-        if not html:
-            continue
-        emails = extract_emails(html)
-        best = pick_best_email(emails)
+    urls = [base if path == "" else base.rstrip("/") + path for path in ("",) + CONTACT_PATHS]
+
+    # toutes les pages en parallèle ; premier contact@/info@ du domaine => on annule le reste
+    host = domain.lower().removeprefix("www.")
+    strong = tuple(p + host for p in STRONG_PREFIXES)
+    futures = {PAGE_POOL.submit(fetch_emails, u, timeout): u for u in urls}
+    emails_by_url = {}
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            url = futures[fut]
+            emails_by_url[url] = fut.result()
+            best = pick_best_email(emails_by_url[url])
+            if best and best.lower() in strong:
+                for p in pending:
+                    p.cancel()
+                return best, url
+
+    # sinon : premier chemin (ordre de priorité) qui donne un email
+    for url in urls:
+        best = pick_best_email(emails_by_url[url])
         if best:
             return best, url
     return None, None
@@ -71,20 +108,16 @@ def main():
     ap.add_argument("--sleep-max", type=float, default=2.2)
     args = ap.parse_args()
 
-    rows = []
-    with open(args.input, newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            rows.append(row)
-            if len(rows) >= args.limit:
-                break
-
+    tested = 0
     found = 0
-    with open(args.output, "w", newline="", encoding="utf-8") as out_f:
+    # lecture en flux : on traite chaque ligne dès qu'elle est lue
+    with open(args.input, newline="", encoding="utf-8") as f, \
+         open(args.output, "w", newline="", encoding="utf-8") as out_f:
         w = csv.DictWriter(out_f, fieldnames=["abn", "legal_name", "domain", "email", "found_url", "method"])
         w.writeheader()
 
-        for row in rows:
+        for row in itertools.islice(csv.DictReader(f), args.limit):
+            tested += 1
             abn = (row.get("abn") or "").strip()
             name = (row.get("legal_name") or "").strip()
             dom = norm_domain(row.get("guessed_domain") or "")
@@ -105,7 +138,7 @@ def main():
 
             time.sleep(random.uniform(args.sleep_min, args.sleep_max))
 
-    print(f"[done] tested={len(rows)} verified_emails={found} output={args.output}")
+    print(f"[done] tested={tested} verified_emails={found} output={args.output}")
 
 if __name__ == "__main__":
     main()
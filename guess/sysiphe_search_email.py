@@ -72,7 +72,7 @@ def score_email(email: str, expected_domain: Optional[str]) -> Tuple[int, str]:
     if expected_domain:
         exp = expected_domain.lower().strip()
         exp = exp.replace("http://", "").replace("https://", "").split("/", 1)[0]
-        exp = exp.lstrip("www.")
+        exp = exp.removeprefix("www.")
         if dom == exp:
             score += 35
             reason.append("domain_match")
@@ -1,9 +1,12 @@
 import os, json, requests, psycopg2
-from psycopg2.extras import RealDictCursor
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import RealDictCursor, execute_batch
 
 DB_DSN = os.environ.get("PG_DSN", "dbname=commercial_ai user=romain")
 MODEL = os.environ.get("OLLAMA_MODEL", "mistral:latest")
 BATCH = int(os.environ.get("CLASSIFY_BATCH", "80"))
+# à aligner sur OLLAMA_NUM_PARALLEL côté serveur
+CONCURRENCY = int(os.environ.get("CLASSIFY_CONCURRENCY", "4"))
 
 SYSTEM = """You are classifying Australian companies for B2B outreach.
 Return STRICT JSON with keys: company_type, score, rationale.
@@ -12,10 +15,17 @@ score: 1 (best target) to 5 (worst).
 rationale: short reason.
 """
 
+# connexion HTTP réutilisée entre les appels
+SESSION = requests.Session()
+
 def ollama_json(prompt: str) -> dict:
-    r = requests.post(
+    r = SESSION.post(
         "http://localhost:11434/api/generate",
-        json={"model": MODEL, "prompt": prompt, "system": SYSTEM, "stream": False},
+        json={
+            "model": MODEL, "prompt": prompt, "system": SYSTEM, "stream": False,
+            # garde le modèle chargé entre les appels, contexte court suffisant
+            "keep_alive": "30m", "options": {"num_ctx": 2048},
+        },
         timeout=60,
     )
     r.raise_for_status()
@@ -27,39 +37,51 @@ def ollama_json(prompt: str) -> dict:
         raise ValueError("No JSON in response: " + text[:200])
     return json.loads(text[start:end+1])
 
+def classify(row) -> tuple:
+    name = row["company_name"] or ""
+    url = row["website_url"] or ""
+    src = row["source_name"]
+    prompt = f"Company name: {name}\nWebsite: {url}\nSource: {src}\nClassify this company."
+    try:
+        out = ollama_json(prompt)
+        ctype = out.get("company_type", "unknown")
+        score = int(out.get("score", 3))
+        rationale = (out.get("rationale") or "")[:240]
+    except Exception as e:
+        ctype, score, rationale = "unknown", 5, f"classify_error: {e}"
+    return ctype, score, rationale
+
 def main():
     conn = psycopg2.connect(DB_DSN)
-    conn.autocommit = True
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            SELECT target_id, company_name, website_url, source_name
-            FROM targets_typed
-            WHERE company_type='unknown'
-            ORDER BY created_at DESC
-            LIMIT %s
-        """, (BATCH,))
-        rows = cur.fetchall()
+    # une seule transaction : les lignes prises restent verrouillées jusqu'au commit,
+    # d'autres instances du script les sautent (SKIP LOCKED) au lieu de les refaire
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT target_id, company_name, website_url, source_name
+                FROM targets_typed
+                WHERE company_type='unknown'
+                ORDER BY created_at DESC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (BATCH,))
+            rows = cur.fetchall()
 
-    for row in rows:
-        name = row["company_name"] or ""
-        url = row["website_url"] or ""
-        src = row["source_name"]
-        prompt = f"Company name: {name}\nWebsite: {url}\nSource: {src}\nClassify this company."
-        try:
-            out = ollama_json(prompt)
-            ctype = out.get("company_type", "unknown")
-            score = int(out.get("score", 3))
-            rationale = (out.get("rationale") or "")[:240]
-        except Exception as e:
-            ctype, score, rationale = "unknown", 5, f"classify_error: {e}"
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            results = list(pool.map(classify, rows))
 
+        updates = []
+        for row, (ctype, score, rationale) in zip(rows, results):
+            updates.append((ctype, score, rationale, row["target_id"]))
+            print(row["target_id"], ctype, score)
+
+        # un seul aller-retour pour tout le batch
         with conn.cursor() as cur:
-            cur.execute("""
+            execute_batch(cur, """
                 UPDATE targets_typed
                 SET company_type=%s, score=%s, rationale=%s, updated_at=now()
                 WHERE target_id=%s
-            """, (ctype, score, rationale, row["target_id"]))
-        print(row["target_id"], ctype, score)
+            """, updates)
 
     conn.close()
 
@@ -3,13 +3,30 @@ import os
 import re
 import time
 import random
+import sqlite3
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urlparse, quote_plus
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401  parseur C, bien plus rapide que html.parser
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+try:
+    import re2 as email_re  # google-re2 : DFA, scan linéaire sur les gros HTML
+except ImportError:
+    email_re = re
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_batch
 
 # -------------------
 # CONFIG
@@ -21,9 +38,15 @@ DB_USER = os.getenv("PGUSER", "romain")
 DB_PASS = os.getenv("PGPASSWORD")
 
 BATCH = int(os.getenv("ENRICH_BATCH", "30"))          # combien on tente
-SLEEP_MIN = float(os.getenv("ENRICH_SLEEP_MIN", "2.0"))
-SLEEP_MAX = float(os.getenv("ENRICH_SLEEP_MAX", "5.0"))
 HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", "15"))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "3"))   # nouvelles tentatives sur 429/503
+BACKOFF_MAX = float(os.getenv("BACKOFF_MAX", "30"))
+SEARCH_INTERVAL = float(os.getenv("SEARCH_INTERVAL", "2.0"))   # secondes min entre 2 requêtes DDG
+SEARCH_CACHE = os.getenv("SEARCH_CACHE", "1") != "0"   # SEARCH_CACHE=0 pour débugger sans cache
+SEARCH_CACHE_DB = os.getenv("SEARCH_CACHE_DB", "/tmp/sysiphe_search_cache_enrich.sqlite")
+SEARCH_CACHE_TTL = 7 * 86400
+PAGE_WORKERS = int(os.getenv("PAGE_WORKERS", "32"))   # pages fetchées en parallèle
+DB_FLUSH = int(os.getenv("DB_FLUSH", "100"))           # lignes prises et commitées par transaction
 
 USER_AGENT = os.getenv(
     "SYSIPHE_UA",
@@ -31,8 +54,27 @@ USER_AGENT = os.getenv(
     "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
 )
 
-EMAIL_RE = re.compile(r"\b[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b")
+PAGE_POOL = ThreadPoolExecutor(max_workers=PAGE_WORKERS)
+
+# une seule session : keep-alive + pool de connexions (pas de handshake TLS par requête)
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": USER_AGENT})
+_adapter = HTTPAdapter(pool_connections=64, pool_maxsize=PAGE_WORKERS)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+# session dédiée aux moteurs de recherche : pool + retries sur erreurs réseau
+SEARCH_SESSION = requests.Session()
+SEARCH_SESSION.headers.update({"User-Agent": USER_AGENT})
+_search_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50,
+                              max_retries=Retry(total=2, backoff_factor=0.5))
+SEARCH_SESSION.mount("http://", _search_adapter)
+SEARCH_SESSION.mount("https://", _search_adapter)
+
+EMAIL_RE = email_re.compile(r"\b[a-zA-Z0-9._%+-]+@(?:[a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}\b")
 BAD_EMAIL_HINTS = ("example.com", "yourcompany.com", "email.com")
+# une de ces adresses sur le site suffit : on arrête de fetcher les autres pages
+STRONG_PREFIXES = ("info@", "contact@")
 
 # -------------------
 SQL_FETCH = """
@@ -47,8 +89,10 @@ JOIN companies_seed cs ON cs.company_id = oq.company_id
 JOIN companies_raw cr ON cr.raw_id = cs.raw_id
 WHERE oq.status='draft_ready'
   AND oq.contact_email IS NULL
+  AND (oq.updated_at IS NULL OR oq.updated_at < %s)
 ORDER BY oq.updated_at
-LIMIT %s;
+LIMIT %s
+FOR UPDATE OF oq SKIP LOCKED
 """
 
 SQL_UPDATE_OK = """
@@ -67,8 +111,70 @@ WHERE outreach_id = %s;
 """
 
 # -------------------
-def sleep_a_bit():
-    time.sleep(random.uniform(SLEEP_MIN, SLEEP_MAX))
+def backoff_delay(attempt: int, retry_after) -> float:
+    """
+    Attente après un 429/503 : Retry-After si le serveur le donne (en secondes),
+    sinon exponentiel + jitter, plafonné à BACKOFF_MAX.
+    """
+    if retry_after and retry_after.strip().isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    return min(BACKOFF_MAX, 2 ** attempt + random.uniform(0, 1))
+
+class RateLimiter:
+    """
+    Espace les appels d'au moins `interval` secondes, tous threads confondus.
+    Remplace le sleep fixe entre deux recherches.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        time.sleep(at - now)
+
+DDG_LIMITER = RateLimiter(SEARCH_INTERVAL)
+
+_search_db = None
+_search_db_lock = threading.Lock()
+
+def cache_search(fn):
+    """
+    Mémo disque (sqlite) des recherches, clé = moteur + requête normalisée, TTL 7 jours.
+    Seuls les domaines trouvés sont gardés : un "" peut venir d'un blocage temporaire.
+    """
+    @functools.wraps(fn)
+    def wrapper(query: str) -> str:
+        global _search_db
+        if not SEARCH_CACHE:
+            return fn(query)
+        key = fn.__name__ + ":" + " ".join(query.lower().split())
+        with _search_db_lock:
+            if _search_db is None:
+                _search_db = sqlite3.connect(SEARCH_CACHE_DB, check_same_thread=False)
+                _search_db.execute(
+                    "CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, domain TEXT, expires REAL)"
+                )
+            row = _search_db.execute(
+                "SELECT domain FROM search_cache WHERE key=? AND expires>?", (key, time.time())
+            ).fetchone()
+        if row:
+            return row[0]
+
+        dom = fn(query)
+        if dom:
+            with _search_db_lock:
+                _search_db.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, domain, expires) VALUES (?, ?, ?)",
+                    (key, dom, time.time() + SEARCH_CACHE_TTL),
+                )
+                _search_db.commit()
+        return dom
+    return wrapper
 
 def norm_domain(url: str) -> str:
     try:
@@ -81,15 +187,18 @@ def norm_domain(url: str) -> str:
     except Exception:
         return ""
 
+@cache_search
 def ddg_search_first_domain(query: str) -> str:
     """
     DuckDuckGo HTML endpoint (simple). Returns a domain or ''.
     """
     q = quote_plus(query)
     url = f"https://duckduckgo.com/html/?q={q}"
-    r = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=HTTP_TIMEOUT)
+    DDG_LIMITER.wait()
+    r = SEARCH_SESSION.get(url, timeout=HTTP_TIMEOUT)
     r.raise_for_status()
-    soup = BeautifulSoup(r.text, "html.parser")
+    # on ne construit que les liens de résultats, pas tout le DOM
+    soup = BeautifulSoup(r.text, HTML_PARSER, parse_only=SoupStrainer("a", class_="result__a"))
 
     # Results links
     for a in soup.select("a.result__a"):
@@ -100,10 +209,24 @@ def ddg_search_first_domain(query: str) -> str:
     return ""
 
 def fetch_url(url: str) -> str:
-    r = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=HTTP_TIMEOUT, allow_redirects=True)
+    """
+    Aucune pause sur 2xx ; on ne ralentit que si le serveur le demande (429/503).
+    """
+    for attempt in range(FETCH_RETRIES + 1):
+        r = SESSION.get(url, timeout=HTTP_TIMEOUT, allow_redirects=True)
+        if r.status_code not in (429, 503) or attempt == FETCH_RETRIES:
+            break
+        time.sleep(backoff_delay(attempt, r.headers.get("Retry-After")))
     r.raise_for_status()
     return r.text
 
+def fetch_page_emails(url: str) -> list[str]:
+    try:
+        html = fetch_url(url)
+    except Exception:
+        return []
+    return extract_emails_from_html(html)
+
 def extract_emails_from_html(html: str) -> list[str]:
     emails = set(e.lower() for e in EMAIL_RE.findall(html))
     clean = []
@@ -113,18 +236,36 @@ def extract_emails_from_html(html: str) -> list[str]:
         clean.append(e)
     return sorted(clean)
 
+# rang de chaque préfixe (plus petit = meilleur), calculé une fois
+PREFIX_PRIORITY = {p: i for i, p in enumerate(("info", "contact", "hello", "support", "admin"))}
+
 def pick_best_email(emails: list[str]) -> str:
     """
     Prefer generic inboxes.
     """
     if not emails:
         return ""
-    priority = ("info@", "contact@", "hello@", "support@", "admin@")
-    for pref in priority:
-        for e in emails:
-            if e.startswith(pref):
-                return e
-    return emails[0]
+    # une seule passe ; à égalité l'ordre de la liste est conservé
+    return min(emails, key=lambda e: PREFIX_PRIORITY.get(e.partition("@")[0], 99))
+
+def collect_site_emails(pages, domain: str) -> set:
+    """
+    Fetch des pages en parallèle ; dès qu'une page donne un info@/contact@
+    du domaine du site, on annule celles qui ne sont pas encore parties.
+    """
+    host = domain.lower().removeprefix("www.")
+    strong = tuple(p + host for p in STRONG_PREFIXES)
+    emails = set()
+    pending = {PAGE_POOL.submit(fetch_page_emails, u) for u in pages}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            emails.update(fut.result())
+        if any(e.lower() in strong for e in emails):
+            for fut in pending:
+                fut.cancel()
+            break
+    return emails
 
 def try_extract_email_from_site(domain: str) -> tuple[str, str]:
     """
@@ -138,15 +279,7 @@ def try_extract_email_from_site(domain: str) -> tuple[str, str]:
         f"https://{domain}/privacy",
     ]
 
-    all_emails = set()
-    for u in pages:
-        try:
-            html = fetch_url(u)
-            for e in extract_emails_from_html(html):
-                all_emails.add(e)
-            sleep_a_bit()
-        except Exception:
-            continue
+    all_emails = collect_site_emails(pages, domain)
 
     best = pick_best_email(sorted(all_emails))
     if best:
@@ -163,73 +296,84 @@ def main():
     )
     conn.autocommit = False
 
-    with conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(SQL_FETCH, (BATCH,))
-        rows = cur.fetchall()
-
-    if not rows:
-        print("No rows to enrich (draft_ready with contact_email NULL).")
-        conn.close()
-        return
-
-    print(f"[+] Enriching {len(rows)} rows...")
+    # début du run : les lignes déjà traitées (même en échec) ont un updated_at plus
+    # récent et ne sont pas reprises par les tranches suivantes
+    with conn.cursor() as cur:
+        cur.execute("SELECT now()")
+        started = cur.fetchone()[0]
+    conn.commit()
 
     ok = 0
     fail = 0
 
-    for r in rows:
-        oid = r["outreach_id"]
-        name = (r["company_name"] or "").strip()
-        abn = (r["abn"] or "").strip()
-        state = (r["state"] or "").strip()
-
-        # Website discovery queries (simple + robust)
-        queries = []
-        if abn:
-            queries.append(f"{abn} {name} website")
-        queries.append(f"{name} Australia website")
-        if state:
-            queries.append(f"{name} {state} Australia")
-
-        domain = ""
-        for q in queries:
-            try:
-                domain = ddg_search_first_domain(q)
-                if domain:
-                    break
-            except Exception:
-                pass
-            sleep_a_bit()
-
-        if not domain:
-            note = f"\nSysiphe_enrich=no_domain_found at={time.strftime('%Y-%m-%dT%H:%M:%S')}"
-            with conn, conn.cursor() as cur2:
-                cur2.execute(SQL_UPDATE_FAIL, (note, oid))
-            fail += 1
-            print(f"[-] {name}: no domain found")
-            continue
-
-        email, reason = try_extract_email_from_site(domain)
-        if email:
-            note = (
-                f"\nSysiphe_enrich=ok domain={domain} reason={reason} "
-                f"at={time.strftime('%Y-%m-%dT%H:%M:%S')}"
-            )
-            with conn, conn.cursor() as cur2:
-                cur2.execute(SQL_UPDATE_OK, (email, note, oid))
-            ok += 1
-            print(f"[✓] {name}: {email} (domain={domain})")
-        else:
-            note = (
-                f"\nSysiphe_enrich=no_email domain={domain} reason={reason} "
-                f"at={time.strftime('%Y-%m-%dT%H:%M:%S')}"
-            )
-            with conn, conn.cursor() as cur2:
-                cur2.execute(SQL_UPDATE_FAIL, (note, oid))
-            fail += 1
-            print(f"[-] {name}: no email (domain={domain})")
-
-        sleep_a_bit()
+    # une tranche de DB_FLUSH lignes par transaction : verrouillées pendant leur
+    # traitement (une autre instance passe aux suivantes), écrites en un paquet puis
+    # commitées ; un crash ne perd que la tranche en cours
+    while ok + fail < BATCH:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(SQL_FETCH, (started, min(DB_FLUSH, BATCH - ok - fail)))
+            rows = cur.fetchall()
+        if not rows:
+            break
+
+        ok_updates = []
+        fail_updates = []
+        for r in rows:
+            oid = r["outreach_id"]
+            name = (r["company_name"] or "").strip()
+            abn = (r["abn"] or "").strip()
+            state = (r["state"] or "").strip()
+
+            # Website discovery queries (simple + robust)
+            queries = []
+            if abn:
+                queries.append(f"{abn} {name} website")
+            queries.append(f"{name} Australia website")
+            if state:
+                queries.append(f"{name} {state} Australia")
+
+            domain = ""
+            for q in queries:
+                try:
+                    domain = ddg_search_first_domain(q)
+                    if domain:
+                        break
+                except Exception:
+                    pass
+
+            if not domain:
+                note = f"\nSysiphe_enrich=no_domain_found at={time.strftime('%Y-%m-%dT%H:%M:%S')}"
+                fail_updates.append((note, oid))
+                fail += 1
+                print(f"[-] {name}: no domain found")
+            else:
+                email, reason = try_extract_email_from_site(domain)
+                if email:
+                    note = (
+                        f"\nSysiphe_enrich=ok domain={domain} reason={reason} "
+                        f"at={time.strftime('%Y-%m-%dT%H:%M:%S')}"
+                    )
+                    ok_updates.append((email, note, oid))
+                    ok += 1
+                    print(f"[✓] {name}: {email} (domain={domain})")
+                else:
+                    note = (
+                        f"\nSysiphe_enrich=no_email domain={domain} reason={reason} "
+                        f"at={time.strftime('%Y-%m-%dT%H:%M:%S')}"
+                    )
+                    fail_updates.append((note, oid))
+                    fail += 1
+                    print(f"[-] {name}: no email (domain={domain})")
+
+        with conn.cursor() as writer:
+            execute_batch(writer, SQL_UPDATE_OK, ok_updates)
+            execute_batch(writer, SQL_UPDATE_FAIL, fail_updates)
+        conn.commit()
+
+    if ok + fail == 0:
+        print("No rows to enrich (draft_ready with contact_email NULL).")
+        conn.close()
+        return
 
     conn.close()
     print(f"[✓] Done. ok={ok} fail={fail}")
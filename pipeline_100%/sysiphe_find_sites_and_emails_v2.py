@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
-import os, re, csv, time, random
+import os, re, csv, time, random, itertools, queue, threading, sqlite3, functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from html import unescape
 from urllib.parse import urlparse, quote_plus
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import re2 as email_re  # google-re2 : DFA, scan linéaire sur les gros HTML
+except ImportError:
+    email_re = re
+
 import psycopg2
+from psycopg2.extras import execute_batch, execute_values
 
 
 # -------------------
@@ -14,9 +24,17 @@ DB_DSN = os.environ.get("PG_DSN", "dbname=commercial_ai user=romain")
 INPUT_CSV = os.environ.get("INPUT_CSV", "/tmp/sysiphe_sitefind_day2_200.csv")
 
 BATCH = int(os.environ.get("SITEFIND_BATCH", "60"))      # combien de targets traiter par run
-SLEEP_MIN = float(os.environ.get("SLEEP_MIN", "1.0"))
-SLEEP_MAX = float(os.environ.get("SLEEP_MAX", "2.5"))
+SEARCH_INTERVAL = float(os.environ.get("SEARCH_INTERVAL", "2.0"))  # secondes min entre 2 requêtes / moteur
+SEARCH_CACHE = os.environ.get("SEARCH_CACHE", "1") != "0"        # SEARCH_CACHE=0 pour débugger sans cache
+SEARCH_CACHE_DB = os.environ.get("SEARCH_CACHE_DB", "/tmp/sysiphe_search_cache_sitefind.sqlite")
+SEARCH_CACHE_TTL = 7 * 86400
 HTTP_TIMEOUT = int(os.environ.get("HTTP_TIMEOUT", "15"))
+FETCH_RETRIES = int(os.environ.get("FETCH_RETRIES", "3"))         # nouvelles tentatives sur 429/503
+BACKOFF_MAX = float(os.environ.get("BACKOFF_MAX", "30"))
+SITEFIND_WORKERS = int(os.environ.get("SITEFIND_WORKERS", "8"))   # targets traités en parallèle
+SITEFIND_PROCS = int(os.environ.get("SITEFIND_PROCS", "1"))      # processus (regex / parsing hors GIL)
+PAGE_WORKERS = int(os.environ.get("PAGE_WORKERS", "32"))          # pages fetchées en parallèle
+DB_FLUSH = int(os.environ.get("DB_FLUSH", "50"))                  # écritures groupées par aller-retour
 
 USER_AGENT = os.environ.get(
     "SYSIPHE_UA",
@@ -24,14 +42,97 @@ USER_AGENT = os.environ.get(
     "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
 )
 
-EMAIL_RE = re.compile(r"\b[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b")
+PAGE_POOL = ThreadPoolExecutor(max_workers=PAGE_WORKERS)
+
+# une seule session : keep-alive + pool de connexions (pas de handshake TLS par requête)
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": USER_AGENT})
+_adapter = HTTPAdapter(pool_connections=64, pool_maxsize=PAGE_WORKERS)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+# session dédiée aux moteurs de recherche : pool + retries sur erreurs réseau
+SEARCH_SESSION = requests.Session()
+SEARCH_SESSION.headers.update({"User-Agent": USER_AGENT})
+_search_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50,
+                              max_retries=Retry(total=2, backoff_factor=0.5))
+SEARCH_SESSION.mount("http://", _search_adapter)
+SEARCH_SESSION.mount("https://", _search_adapter)
+
+EMAIL_RE = email_re.compile(r"\b[a-zA-Z0-9._%+-]+@(?:[a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}\b")
 BAD_EMAIL_HINTS = ("example.com", "yourcompany.com", "email.com")
+# une de ces adresses sur le site suffit : on arrête de fetcher les autres pages
+STRONG_PREFIXES = ("info@", "contact@")
+
+# extraction des liens de résultats par regex : pas de DOM à construire
+GOOGLE_HREF_RE = re.compile(r"""href=["'](/url\?q=[^"']+)""")
+DDG_RESULT_RE = re.compile(r"""<a\b[^>]*\bclass=["'][^"']*\bresult__a\b[^>]*>""", re.IGNORECASE)
+HREF_ATTR_RE = re.compile(r"""\bhref=["']([^"']*)""", re.IGNORECASE)
 
 GOOD_DOMAIN_HINTS = ("com.au", "net.au", "org.au", "edu.au", "gov.au", "au")
 
 
-def sleep_a_bit():
-    time.sleep(random.uniform(SLEEP_MIN, SLEEP_MAX))
+class RateLimiter:
+    """
+    Espace les appels d'au moins `interval` secondes, tous threads confondus.
+    Un limiter par moteur de recherche : seules les requêtes vers le même moteur
+    s'attendent entre elles.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        time.sleep(at - now)
+
+
+GOOGLE_LIMITER = RateLimiter(SEARCH_INTERVAL)
+DDG_LIMITER = RateLimiter(SEARCH_INTERVAL)
+
+
+_search_db = None
+_search_db_lock = threading.Lock()
+
+
+def cache_search(fn):
+    """
+    Mémo disque (sqlite) des recherches, clé = moteur + requête normalisée, TTL 7 jours.
+    Seuls les domaines trouvés sont gardés : un "" peut venir d'un blocage temporaire.
+    """
+    @functools.wraps(fn)
+    def wrapper(query: str) -> str:
+        global _search_db
+        if not SEARCH_CACHE:
+            return fn(query)
+        key = fn.__name__ + ":" + " ".join(query.lower().split())
+        with _search_db_lock:
+            if _search_db is None:
+                # timeout : le fichier est partagé entre les processus (SITEFIND_PROCS)
+                _search_db = sqlite3.connect(SEARCH_CACHE_DB, check_same_thread=False, timeout=30)
+                _search_db.execute(
+                    "CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, domain TEXT, expires REAL)"
+                )
+            row = _search_db.execute(
+                "SELECT domain FROM search_cache WHERE key=? AND expires>?", (key, time.time())
+            ).fetchone()
+        if row:
+            return row[0]
+
+        dom = fn(query)
+        if dom:
+            with _search_db_lock:
+                _search_db.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, domain, expires) VALUES (?, ?, ?)",
+                    (key, dom, time.time() + SEARCH_CACHE_TTL),
+                )
+                _search_db.commit()
+        return dom
+    return wrapper
 
 
 def norm_domain(url: str) -> str:
@@ -60,6 +161,7 @@ def is_plausible_domain(dom: str) -> bool:
     return any(dom.endswith(suf) for suf in GOOD_DOMAIN_HINTS) or "." in dom
 
 
+@cache_search
 def google_search_first_domain(query: str) -> str:
     """
     Recherche Google HTML légère (peut être bloquée par consent/captcha).
@@ -67,29 +169,30 @@ def google_search_first_domain(query: str) -> str:
     """
     q = quote_plus(query)
     url = f"https://www.google.com/search?hl=en&q={q}"
-    r = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=HTTP_TIMEOUT)
+    GOOGLE_LIMITER.wait()
+    r = SEARCH_SESSION.get(url, timeout=HTTP_TIMEOUT)
     txt = r.text.lower()
 
     # consent / captcha / unusual traffic -> bail out
     if "consent.google" in txt or "unusual traffic" in txt or "our systems have detected" in txt:
         return ""
 
-    soup = BeautifulSoup(r.text, "html.parser")
-    for a in soup.select("a"):
-        href = a.get("href") or ""
-        if href.startswith("/url?q="):
-            real = href.split("/url?q=")[1].split("&")[0]
-            dom = norm_domain(real)
-            if is_plausible_domain(dom):
-                return dom
+    for m in GOOGLE_HREF_RE.finditer(r.text):
+        href = unescape(m.group(1))
+        real = href.split("/url?q=")[1].split("&")[0]
+        dom = norm_domain(real)
+        if is_plausible_domain(dom):
+            return dom
     return ""
 
 
+@cache_search
 def ddg_search_first_domain(query: str) -> str:
     q = quote_plus(query)
     url = f"https://duckduckgo.com/html/?q={q}"
     try:
-        r = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=HTTP_TIMEOUT)
+        DDG_LIMITER.wait()
+        r = SEARCH_SESSION.get(url, timeout=HTTP_TIMEOUT)
         # Si DDG renvoie 403/429, on stoppe proprement
         if r.status_code in (403, 429):
             return ""
@@ -97,25 +200,44 @@ def ddg_search_first_domain(query: str) -> str:
     except Exception:
         return ""
 
-    soup = BeautifulSoup(r.text, "html.parser")
-    for a in soup.select("a.result__a"):
-        href = a.get("href") or ""
+    for m in DDG_RESULT_RE.finditer(r.text):
+        h = HREF_ATTR_RE.search(m.group(0))
+        href = unescape(h.group(1)) if h else ""
         dom = norm_domain(href)
         if is_plausible_domain(dom):
             return dom
     return ""
 
+def backoff_delay(attempt: int, retry_after) -> float:
+    """
+    Attente après un 429/503 : Retry-After si le serveur le donne (en secondes),
+    sinon exponentiel + jitter, plafonné à BACKOFF_MAX.
+    """
+    if retry_after and retry_after.strip().isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    return min(BACKOFF_MAX, 2 ** attempt + random.uniform(0, 1))
+
+
 def fetch_url(url: str) -> str:
-    r = requests.get(
-        url,
-        headers={"User-Agent": USER_AGENT},
-        timeout=HTTP_TIMEOUT,
-        allow_redirects=True
-    )
+    """
+    Aucune pause sur 2xx ; on ne ralentit que si le serveur le demande (429/503).
+    """
+    for attempt in range(FETCH_RETRIES + 1):
+        r = SESSION.get(url, timeout=HTTP_TIMEOUT, allow_redirects=True)
+        if r.status_code not in (429, 503) or attempt == FETCH_RETRIES:
+            break
+        time.sleep(backoff_delay(attempt, r.headers.get("Retry-After")))
     r.raise_for_status()
     return r.text
 
 
+def fetch_page_emails(url: str) -> list[str]:
+    try:
+        return extract_emails(fetch_url(url))
+    except Exception:
+        return []
+
+
 def extract_emails(html: str) -> list[str]:
     emails = set(e.lower() for e in EMAIL_RE.findall(html))
     clean = []
@@ -126,18 +248,38 @@ def extract_emails(html: str) -> list[str]:
     return sorted(clean)
 
 
+# rang de chaque préfixe (plus petit = meilleur), calculé une fois
+PREFIX_PRIORITY = {p: i for i, p in enumerate((
+    "info", "contact", "hello", "sales", "support", "admin",
+    "enquiries", "enquiry", "office", "team"
+))}
+
+
 def pick_best_email(emails: list[str]) -> str:
     if not emails:
         return ""
-    preferred_prefixes = (
-        "info@", "contact@", "hello@", "sales@", "support@", "admin@",
-        "enquiries@", "enquiry@", "office@", "team@"
-    )
-    for p in preferred_prefixes:
-        for e in emails:
-            if e.startswith(p):
-                return e
-    return emails[0]
+    # une seule passe ; à égalité l'ordre de la liste est conservé
+    return min(emails, key=lambda e: PREFIX_PRIORITY.get(e.partition("@")[0], 99))
+
+
+def collect_site_emails(pages, domain: str) -> set:
+    """
+    Fetch des pages en parallèle ; dès qu'une page donne un info@/contact@
+    du domaine du site, on annule celles qui ne sont pas encore parties.
+    """
+    host = domain.lower().removeprefix("www.")
+    strong = tuple(p + host for p in STRONG_PREFIXES)
+    emails = set()
+    pending = {PAGE_POOL.submit(fetch_page_emails, u) for u in pages}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            emails.update(fut.result())
+        if any(e.lower() in strong for e in emails):
+            for fut in pending:
+                fut.cancel()
+            break
+    return emails
 
 
 SQL_UPDATE_SITE = """
@@ -149,84 +291,188 @@ SET website_domain = %s,
 WHERE target_id = %s;
 """
 
-SQL_INSERT_CONTACT = """
+SQL_INSERT_CONTACTS = """
 INSERT INTO targets_contacts (target_id, email, status, found_method, found_url)
-VALUES (%s, %s, 'found', %s, %s)
+VALUES %s
 ON CONFLICT (email) DO NOTHING;
 """
 
 
-def main():
-    # Load CSV targets
-    rows = []
-    with open(INPUT_CSV, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows.append((r["target_id"], r["company_name"]))
+def write_rows_one_by_one(conn, site_updates: list, contacts: list):
+    """
+    Repli après l'échec d'un paquet : une requête (donc une transaction) par ligne,
+    seule la ligne fautive est perdue (ex. UNIQUE (country_code, website_domain)
+    quand deux targets tombent sur le même domaine).
+    """
+    with conn.cursor() as cur:
+        for params in site_updates:
+            try:
+                cur.execute(SQL_UPDATE_SITE, params)
+            except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                print(f"[db] site ignoré (target {params[-1]}): {type(e).__name__}: {str(e).strip()}")
+        for params in contacts:
+            try:
+                execute_values(cur, SQL_INSERT_CONTACTS, [params],
+                               template="(%s, %s, 'found', %s, %s)")
+            except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                print(f"[db] contact ignoré (target {params[0]}): {type(e).__name__}: {str(e).strip()}")
+
+
+def flush_writes(conn, site_updates: list, contacts: list):
+    # execute_batch envoie le paquet en une requête : Postgres l'exécute en une
+    # transaction implicite, une ligne en erreur annule tout le paquet
+    # (sites et contacts à part : un paquet déjà passé n'est pas rejoué)
+    with conn.cursor() as cur:
+        if site_updates:
+            try:
+                execute_batch(cur, SQL_UPDATE_SITE, site_updates, page_size=DB_FLUSH)
+            except (psycopg2.IntegrityError, psycopg2.DataError):
+                write_rows_one_by_one(conn, site_updates, [])
+        if contacts:
+            try:
+                execute_values(cur, SQL_INSERT_CONTACTS, contacts,
+                               template="(%s, %s, 'found', %s, %s)", page_size=DB_FLUSH)
+            except (psycopg2.IntegrityError, psycopg2.DataError):
+                write_rows_one_by_one(conn, [], contacts)
+    site_updates.clear()
+    contacts.clear()
 
-    rows = rows[:BATCH]
+
+def db_writer(conn, q: queue.Queue, errors: list, failed: threading.Event):
+    """
+    Seul thread qui parle à Postgres : les workers poussent ("site"|"contact", params)
+    dans q, on envoie par paquets de DB_FLUSH. None = fin.
+    Une ligne refusée (contrainte, donnée invalide) est seule perdue ; une autre
+    erreur SQL (connexion...) est gardée dans `errors` (relevée après join) et
+    `failed` prévient les workers d'arrêter. La queue continue d'être vidée pour
+    ne pas bloquer ni gonfler côté workers.
+    """
+    site_updates, contacts = [], []
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        if errors:
+            continue
+        kind, params = item
+        (site_updates if kind == "site" else contacts).append(params)
+        if len(site_updates) + len(contacts) >= DB_FLUSH:
+            try:
+                flush_writes(conn, site_updates, contacts)
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+    if not errors:
+        try:
+            flush_writes(conn, site_updates, contacts)
+        except Exception as e:
+            errors.append(e)
+            failed.set()
+
+
+def process_target(target_id, name, db_q: queue.Queue, db_failed: threading.Event) -> str:
+    """
+    Retourne "no_site", "site" ou "site_email" ("aborted" si l'écriture en base a échoué).
+    """
+    # plus rien ne sera écrit : inutile de chercher / scraper pour rien
+    if db_failed.is_set():
+        return "aborted"
+
+    query = f"{name} Australia official website"
+
+    dom = google_search_first_domain(query)
+    method = "google"
+    if not dom:
+        dom = ddg_search_first_domain(query)
+        method = "ddg_fallback"
+
+    if not dom:
+        # IMPORTANT: NULLs avoid UNIQUE conflict on (country_code, website_domain)
+        db_q.put(("site", (None, None, f"\n[site] no_domain_found ({method})", target_id)))
+        return "no_site"
+
+    site_url = "https://" + dom
+
+    # update site in targets_typed
+    db_q.put(("site", (dom, site_url, f"\n[site] {method} -> {dom}", target_id)))
+
+    candidate_pages = (
+        site_url,
+        site_url + "/contact",
+        site_url + "/contact-us",
+        site_url + "/about",
+        site_url + "/about-us",
+        site_url + "/support",
+    )
+
+    if db_failed.is_set():
+        return "aborted"
+
+    emails_found = collect_site_emails(candidate_pages, dom)
+    best = pick_best_email(sorted(emails_found))
+    if best:
+        db_q.put(("contact", (target_id, best, "site_scrape", site_url)))
+        return "site_email"
+
+    db_q.put(("site", (dom, site_url, f"\n[email] no_email_found_on_site", target_id)))
+    return "site"
+
+
+def process_shard(rows, procs: int = 1, shard: int = 0) -> list:
+    """
+    Traite une tranche de targets dans le processus courant : sa propre connexion
+    Postgres, son thread d'écriture et son pool de workers.
+    """
+    # chaque processus a ses limiters : on étire l'intervalle pour garder
+    # le même débit global vers chaque moteur, et on décale le premier créneau
+    # de chaque tranche pour que les processus ne partent pas tous ensemble
+    # (monotonic est commun à tous les processus de la machine)
+    GOOGLE_LIMITER.interval = DDG_LIMITER.interval = SEARCH_INTERVAL * procs
+    GOOGLE_LIMITER.next_at = DDG_LIMITER.next_at = time.monotonic() + shard * SEARCH_INTERVAL
 
     conn = psycopg2.connect(DB_DSN)
     conn.autocommit = True
 
-    ok_site = 0
-    ok_email = 0
-    fail = 0
-
-    for target_id, name in rows:
-        query = f"{name} Australia official website"
-
-        dom = google_search_first_domain(query)
-        method = "google"
-        if not dom:
-            dom = ddg_search_first_domain(query)
-            method = "ddg_fallback"
-
-        if not dom:
-            with conn.cursor() as cur:
-                # IMPORTANT: NULLs avoid UNIQUE conflict on (country_code, website_domain)
-                cur.execute(SQL_UPDATE_SITE, (None, None, f"\n[site] no_domain_found ({method})", target_id))
-            fail += 1
-            sleep_a_bit()
-            continue
+    db_q = queue.Queue()
+    db_errors = []
+    db_failed = threading.Event()
+    writer = threading.Thread(target=db_writer, args=(conn, db_q, db_errors, db_failed))
+    writer.start()
 
-        site_url = "https://" + dom
+    try:
+        with ThreadPoolExecutor(max_workers=SITEFIND_WORKERS) as pool:
+            outcomes = list(pool.map(lambda r: process_target(r[0], r[1], db_q, db_failed), rows))
+    finally:
+        db_q.put(None)
+        writer.join()
+        conn.close()
 
-        # update site in targets_typed
-        with conn.cursor() as cur:
-            cur.execute(SQL_UPDATE_SITE, (dom, site_url, f"\n[site] {method} -> {dom}", target_id))
-        ok_site += 1
+    # écritures perdues : le run doit échouer, pas afficher un bilan normal
+    if db_errors:
+        raise db_errors[0]
+    return outcomes
 
-        emails_found = set()
-        candidate_pages = (
-            site_url,
-            site_url + "/contact",
-            site_url + "/contact-us",
-            site_url + "/about",
-            site_url + "/about-us",
-            site_url + "/support",
-        )
 
-        for u in candidate_pages:
-            try:
-                html = fetch_url(u)
-                for e in extract_emails(html):
-                    emails_found.add(e)
-            except Exception:
-                pass
-
-        best = pick_best_email(sorted(emails_found))
-        if best:
-            with conn.cursor() as cur:
-                cur.execute(SQL_INSERT_CONTACT, (target_id, best, "site_scrape", site_url))
-            ok_email += 1
-        else:
-            with conn.cursor() as cur:
-                cur.execute(SQL_UPDATE_SITE, (dom, site_url, f"\n[email] no_email_found_on_site", target_id))
-
-        sleep_a_bit()
-
-    conn.close()
+def main():
+    # Load CSV targets
+    # on s'arrête à BATCH lignes, sans lire le reste du CSV
+    with open(INPUT_CSV, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        rows = [(r["target_id"], r["company_name"]) for r in itertools.islice(reader, BATCH)]
+
+    procs = max(1, min(SITEFIND_PROCS, len(rows)))
+    if procs == 1:
+        outcomes = process_shard(rows)
+    else:
+        # une tranche par processus : le CPU (regex, parsing) se répartit sur les cœurs
+        shards = [rows[i::procs] for i in range(procs)]
+        with ProcessPoolExecutor(max_workers=procs) as pool:
+            parts = pool.map(process_shard, shards, [procs] * procs, range(procs))
+            outcomes = [o for part in parts for o in part]
+
+    ok_site = sum(1 for o in outcomes if o != "no_site")
+    ok_email = outcomes.count("site_email")
+    fail = outcomes.count("no_site")
     print(f"[done] batch={len(rows)} ok_site={ok_site} ok_email={ok_email} fail={fail}")
 
 
@@ -1,16 +1,33 @@
 #!/usr/bin/env python3
-import os, re, csv, time, random
+import os, re, csv, itertools, multiprocessing, hashlib, socket, threading, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from urllib.parse import urlparse
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.connection import allowed_gai_family
+from urllib3.util.retry import Retry
+
+try:
+    import re2 as email_re  # google-re2 : DFA, scan linéaire sur les gros HTML
+except ImportError:
+    email_re = re
+
 import psycopg2
+from psycopg2.extras import execute_values
 
 DB_DSN = os.environ.get("PG_DSN", "dbname=commercial_ai user=romain")
 INPUT_CSV = os.environ.get("INPUT_CSV", "/tmp/sysiphe_sites_existing_80.csv")
 
 BATCH = int(os.environ.get("EMAIL_BATCH", "80"))
-SLEEP_MIN = float(os.environ.get("SLEEP_MIN", "0.8"))
-SLEEP_MAX = float(os.environ.get("SLEEP_MAX", "2.0"))
 HTTP_TIMEOUT = int(os.environ.get("HTTP_TIMEOUT", "15"))
+SCRAPE_WORKERS = int(os.environ.get("SCRAPE_WORKERS", "8"))   # sites traités en parallèle
+PAGE_WORKERS = int(os.environ.get("PAGE_WORKERS", "32"))      # pages fetchées en parallèle
+MAX_BODY = int(os.environ.get("MAX_BODY", "2000000"))         # octets lus au plus par page
+EXTRACT_PROCS = int(os.environ.get("EXTRACT_PROCS", "0"))     # >0 : regex dans N processus (hors GIL)
+DB_FLUSH = int(os.environ.get("DB_FLUSH", "50"))              # contacts insérés par aller-retour
+DNS_CACHE_TTL = int(os.environ.get("DNS_CACHE_TTL", "300"))   # secondes de cache DNS (fetchs HTTP)
 
 USER_AGENT = os.environ.get(
     "SYSIPHE_UA",
@@ -18,87 +35,300 @@ USER_AGENT = os.environ.get(
     "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
 )
 
-EMAIL_RE = re.compile(r"\b[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}\b")
+# appliquée au html déjà passé en minuscules (cf. extract_emails)
+EMAIL_RE = email_re.compile(r"\b[a-z0-9._%+-]+@(?:[a-z0-9-]+\.)+[a-z]{2,}\b")
 BAD_EMAIL_HINTS = ("example.com", "yourcompany.com", "email.com")
+BAD_RE = re.compile("|".join(map(re.escape, BAD_EMAIL_HINTS)))
+# une de ces adresses sur le domaine du site suffit : on arrête de fetcher les autres pages
+STRONG_PREFIXES = ("info@", "contact@", "hello@")
+# au-delà de ce nombre de '@' dans une page, le scan fenêtré coûte plus qu'un findall
+SCAN_MAX_AT = 256
+
+PAGE_POOL = ThreadPoolExecutor(max_workers=PAGE_WORKERS)
+# créé par main() si EXTRACT_PROCS > 0
+EXTRACT_POOL = None
+
+# cache DNS limité à SESSION : hôte -> (ip, expiration). Les connexions (re)ouvertes
+# vers un hôte déjà vu ne refont pas de getaddrinfo ; le reste du process
+# (psycopg2...) résout normalement. Les échecs ne sont pas mis en cache.
+_dns_cache = {}
+_dns_lock = threading.Lock()
+
+
+def cached_resolve(host: str, port: int) -> str:
+    now = time.monotonic()
+    with _dns_lock:
+        hit = _dns_cache.get(host)
+    if hit and hit[1] > now:
+        return hit[0]
+    try:
+        infos = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+    except OSError:
+        return host  # urllib3 refait la résolution et remonte son erreur habituelle
+    ip = infos[0][4][0]
+    with _dns_lock:
+        _dns_cache[host] = (ip, now + DNS_CACHE_TTL)
+    return ip
+
+
+class _CachedDNSMixin:
+    def _new_conn(self):
+        # seul le connect TCP voit l'IP : SNI, certificat et en-tête Host gardent le nom
+        host = self._dns_host
+        self._dns_host = cached_resolve(host, self.port)
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+
+class CachedDNSHTTPConnection(_CachedDNSMixin, HTTPConnection):
+    pass
+
+
+class CachedDNSHTTPSConnection(_CachedDNSMixin, HTTPSConnection):
+    pass
+
+
+class CachedDNSHTTPPool(HTTPConnectionPool):
+    ConnectionCls = CachedDNSHTTPConnection
+
+
+class CachedDNSHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = CachedDNSHTTPSConnection
+
+
+class CachedDNSAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CachedDNSHTTPPool,
+            "https": CachedDNSHTTPSPool,
+        }
+
 
-SQL_INSERT_CONTACT = """
+# une seule session : keep-alive + pool de connexions, les 7 pages d'un site
+# réutilisent la même connexion TLS
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": USER_AGENT})
+_adapter = CachedDNSAdapter(pool_connections=32, pool_maxsize=64,
+                            max_retries=Retry(total=2, backoff_factor=0.3))
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+SQL_INSERT_CONTACTS = """
 INSERT INTO targets_contacts (target_id, email, status, found_method, found_url)
-VALUES (%s, %s, 'found', %s, %s)
+VALUES %s
 ON CONFLICT (email) DO NOTHING;
 """
 
-def sleep_a_bit():
-    time.sleep(random.uniform(SLEEP_MIN, SLEEP_MAX))
+def flush_contacts(conn, contacts: list):
+    if contacts:
+        with conn, conn.cursor() as cur:
+            execute_values(cur, SQL_INSERT_CONTACTS, contacts,
+                           template="(%s, %s, 'found', %s, %s)")
+    contacts.clear()
 
-def fetch_url(url: str) -> str:
-    r = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=HTTP_TIMEOUT, allow_redirects=True)
-    r.raise_for_status()
-    return r.text
+def decode_body(body: bytes, encoding) -> str:
+    # comme Response.text : charset inconnu (ex. "utf8mb4") => utf-8 avec remplacement
+    try:
+        return body.decode(encoding or "utf-8", errors="replace")
+    except (LookupError, TypeError):
+        return body.decode("utf-8", errors="replace")
 
-def extract_emails(html: str):
-    emails = set(e.lower() for e in EMAIL_RE.findall(html))
-    clean = []
-    for e in emails:
-        if any(bad in e for bad in BAD_EMAIL_HINTS):
+def fetch_url(url: str) -> tuple[str, bytes, str]:
+    """
+    Retourne (url finale après redirections, empreinte du corps brut, corps).
+    Corps lu en flux et tronqué à MAX_BODY : une page énorme (sitemap, pdf servi
+    en html...) ne gonfle ni la mémoire ni le scan regex. Hors texte => "".
+    """
+    with SESSION.get(url, timeout=HTTP_TIMEOUT, allow_redirects=True, stream=True) as r:
+        r.raise_for_status()
+        ctype = (r.headers.get("content-type") or "").lower()
+        if "text/html" not in ctype and "text/plain" not in ctype:
+            return r.url, b"", ""
+        buf = bytearray()
+        for chunk in r.iter_content(65536):
+            buf += chunk
+            if len(buf) >= MAX_BODY:
+                break
+        body = bytes(buf[:MAX_BODY])
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        return r.url, digest, decode_body(body, r.encoding)
+
+# caractères possibles autour du '@' (html déjà en minuscules), cf. EMAIL_RE
+LOCAL_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789._%+-")
+DOMAIN_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789.-")
+
+def iter_email_matches(html: str):
+    """
+    Scan ancré sur les '@' : str.find (memchr) saute le texte sans '@', la regex ne
+    tourne que sur une fenêtre autour de chacun. La fenêtre couvre toute la suite de
+    caractères de partie locale avant le '@' et de domaine après, plus un caractère
+    de contexte de chaque côté pour que les \\b tombent comme dans un findall
+    (une fenêtre fixe coupait les longues suites et inventait des adresses).
+    Page pleine de '@' : un findall classique.
+    """
+    if html.count("@") > SCAN_MAX_AT:
+        yield from EMAIL_RE.findall(html)
+        return
+    n = len(html)
+    pos = 0
+    while True:
+        at = html.find("@", pos)
+        if at < 0:
+            return
+        lo = at
+        while lo > pos and html[lo - 1] in LOCAL_CHARS:
+            lo -= 1
+        hi = at + 1
+        while hi < n and html[hi] in DOMAIN_CHARS:
+            hi += 1
+        hi = min(n, hi + 1)
+        if lo > 0 and lo == pos and html[lo - 1] in LOCAL_CHARS:
+            # collé à l'adresse précédente : le contexte est déjà consommé,
+            # seule une recherche positionnée sur la page entière voit le bon \b
+            m = EMAIL_RE.search(html, pos, hi)
+            off = 0
+        else:
+            # lo - 1 : caractère de contexte, hors partie locale donc jamais début de match
+            lo = max(0, lo - 1)
+            m = EMAIL_RE.search(html[lo:hi])
+            off = lo
+        if m is None:
+            pos = at + 1
             continue
-        clean.append(e)
-    return sorted(clean)
+        yield m.group(0)
+        pos = off + m.end()
+
+def extract_emails(html: str):
+    # une seule mise en minuscules de la page, plutôt qu'un .lower() par match ;
+    # dédup en une passe, ordre d'apparition conservé
+    found = dict.fromkeys(iter_email_matches(html.lower()))
+    return [e for e in found if not BAD_RE.search(e)]
+
+# rang de chaque préfixe (plus petit = meilleur), calculé une fois
+PREFIX_PRIORITY = {p: i for i, p in enumerate(
+    ("info", "contact", "hello", "sales", "support", "admin", "enquiries", "enquiry", "office")
+)}
 
 def pick_best_email(emails):
     if not emails:
         return ""
-    preferred_prefixes = ("info@", "contact@", "hello@", "sales@", "support@", "admin@", "enquiries@", "enquiry@", "office@")
-    for p in preferred_prefixes:
-        for e in emails:
-            if e.startswith(p):
-                return e
-    return emails[0]
+    # une seule passe ; à égalité l'ordre de la liste est conservé
+    return min(emails, key=lambda e: PREFIX_PRIORITY.get(e.partition("@")[0], 99))
+
+def fetch_page(url: str):
+    try:
+        return fetch_url(url)
+    except Exception:
+        return None
+
+def scan_emails(html: str):
+    if EXTRACT_POOL is not None:
+        # le thread attend le scan sans tenir le GIL : les autres fetchs continuent
+        return EXTRACT_POOL.submit(extract_emails, html).result()
+    return extract_emails(html)
+
+def scrape_site(site_url: str) -> list:
+    """
+    Les pages candidates d'un site sont fetchées en parallèle :
+    le temps d'un site = la page la plus lente, pas la somme.
+    Dès qu'un info@/contact@/hello@ du domaine du site apparaît, on annule
+    les pages pas encore parties.
+    Une page déjà vue (même url finale, ex. /contact -> /contact-us, ou même
+    corps) n'est pas rescannée ; ses emails restent à la page de plus petit
+    rang, quel que soit l'ordre d'arrivée.
+    """
+    host = (urlparse(site_url).hostname or "").removeprefix("www.")
+    strong = tuple(p + host for p in STRONG_PREFIXES)
+    pages = (
+        site_url,
+        site_url + "/contact",
+        site_url + "/contact-us",
+        site_url + "/about",
+        site_url + "/about-us",
+        site_url + "/support",
+        site_url + "/help",
+    )
+    futures = {PAGE_POOL.submit(fetch_page, u): i for i, u in enumerate(pages)}
+    by_page = [()] * len(pages)
+    owner = {}  # url finale / empreinte -> (rang de la page qui garde les emails, emails)
+    for fut in as_completed(futures):
+        i = futures[fut]
+        page = fut.result()
+        if not page or not page[2]:
+            continue
+        final_url, digest, html = page
+        known = owner.get(final_url) or owner.get(digest)
+        if known:
+            j, emails = known
+            if i > j:
+                continue
+            by_page[j] = ()
+        else:
+            emails = scan_emails(html)
+        by_page[i] = emails
+        owner[final_url] = owner[digest] = (i, emails)
+        if any(e in strong for e in emails):
+            for f in futures:
+                f.cancel()
+            break
+
+    # ordre des pages puis ordre d'apparition : à priorité égale, la première trouvée gagne
+    emails_found = {}
+    for emails in by_page:
+        emails_found.update(dict.fromkeys(emails))
+    return list(emails_found)
+
+def start_extract_pool(procs: int) -> ProcessPoolExecutor:
+    """
+    Workers forkés tout de suite, avant qu'aucun thread ne tourne : ils héritent
+    de extract_emails sans réimporter le script (pas de session, pas de pool imbriqué).
+    Avec fork, le premier submit lance tous les workers d'un coup.
+    """
+    pool = ProcessPoolExecutor(max_workers=procs, mp_context=multiprocessing.get_context("fork"))
+    pool.submit(extract_emails, "").result()
+    return pool
 
 def main():
-    rows = []
+    global EXTRACT_POOL
+
+    # on s'arrête à BATCH lignes, sans lire le reste du CSV
     with open(INPUT_CSV, newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f)
-        for r in reader:
-            rows.append((r["target_id"], r["website_url"]))
+        rows = [(r["target_id"], r["website_url"]) for r in itertools.islice(reader, BATCH)]
 
-    rows = rows[:BATCH]
+    if EXTRACT_PROCS > 0:
+        EXTRACT_POOL = start_extract_pool(EXTRACT_PROCS)
 
     conn = psycopg2.connect(DB_DSN)
-    conn.autocommit = True
 
     ok_email = 0
     fail = 0
+    to_insert = []
 
-    for target_id, site_url in rows:
-        emails_found = set()
-        pages = (
-            site_url,
-            site_url + "/contact",
-            site_url + "/contact-us",
-            site_url + "/about",
-            site_url + "/about-us",
-            site_url + "/support",
-            site_url + "/help",
-        )
-        for u in pages:
-            try:
-                html = fetch_url(u)
-                for e in extract_emails(html):
-                    emails_found.add(e)
-            except Exception:
-                pass
-
-        best = pick_best_email(sorted(emails_found))
-        if best:
-            with conn.cursor() as cur:
-                cur.execute(SQL_INSERT_CONTACT, (target_id, best, "site_scrape", site_url))
-            ok_email += 1
-        else:
-            fail += 1
-
-        sleep_a_bit()
+    try:
+        # sites scrapés en parallèle (sites différents : pas de pause entre deux) ;
+        # les inserts partent par paquets pendant que les workers continuent de fetcher
+        with ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as pool:
+            results = pool.map(lambda r: scrape_site(r[1]), rows)
+            for (target_id, site_url), emails_found in zip(rows, results):
+                best = pick_best_email(emails_found)
+                if best:
+                    to_insert.append((target_id, best, "site_scrape", site_url))
+                    ok_email += 1
+                    if len(to_insert) >= DB_FLUSH:
+                        flush_contacts(conn, to_insert)
+                else:
+                    fail += 1
 
-    conn.close()
+        flush_contacts(conn, to_insert)
+    finally:
+        if EXTRACT_POOL is not None:
+            EXTRACT_POOL.shutdown()
+            EXTRACT_POOL = None
+        conn.close()
     print(f"[done] batch={len(rows)} ok_email={ok_email} fail={fail}")
 
 if __name__ == "__main__":
@@ -3,17 +3,43 @@
 
 import argparse
 import csv
+import functools
+import itertools
 import os
 import re
+import socket
 import sys
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional, Set, Tuple
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.connection import allowed_gai_family
+from urllib3.util.retry import Retry
 
+try:
+    import orjson  # parse les réponses SerpApi en C, directement depuis les octets
+except ImportError:
+    orjson = None
 
-EMAIL_RE = re.compile(r"\b[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,}\b", re.IGNORECASE)
+
+# pages crawlées directement quand le domaine est connu (--expected-domain-field)
+DIRECT_PAGES = ("/", "/contact", "/contact-us", "/about", "/about-us")
+
+# octets lus au plus par page : au-delà on tronque (mémoire + scan regex bornés)
+MAX_BODY = 2_000_000
+
+# durée (s) du cache DNS des fetchs HTTP
+DNS_CACHE_TTL = 300
+
+EMAIL_RE = re.compile(r"\b[A-Z0-9._%+-]+@(?:[A-Z0-9-]+\.)+[A-Z]{2,}\b", re.IGNORECASE)
 
 # Emails "génériques" qu'on préfère (ordre)
 LOCALPART_PRIORITY = [
@@ -27,6 +53,119 @@ LOCALPART_PRIORITY = [
     "enquiry",
     "privacy",
 ]
+LOCALPART_INDEX = {lp: i for i, lp in enumerate(LOCALPART_PRIORITY)}
+
+FREE_DOMAINS = frozenset({
+    "gmail.com", "googlemail.com", "outlook.com", "hotmail.com", "live.com",
+    "yahoo.com", "yahoo.com.au", "icloud.com", "aol.com", "proton.me", "protonmail.com"
+})
+
+
+# cache DNS limité à SESSION : hôte -> (ip, expiration). Les connexions (re)ouvertes
+# vers un hôte déjà vu ne refont pas de getaddrinfo ; le reste du process
+# (psycopg2...) résout normalement. Les échecs ne sont pas mis en cache.
+_dns_cache: Dict[str, Tuple[str, float]] = {}
+_dns_lock = threading.Lock()
+
+
+def cached_resolve(host: str, port: int) -> str:
+    now = time.monotonic()
+    with _dns_lock:
+        hit = _dns_cache.get(host)
+    if hit and hit[1] > now:
+        return hit[0]
+    try:
+        infos = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+    except OSError:
+        return host  # urllib3 refait la résolution et remonte son erreur habituelle
+    ip = infos[0][4][0]
+    with _dns_lock:
+        _dns_cache[host] = (ip, now + DNS_CACHE_TTL)
+    return ip
+
+
+class _CachedDNSMixin:
+    def _new_conn(self):
+        # seul le connect TCP voit l'IP : SNI, certificat et en-tête Host gardent le nom
+        host = self._dns_host
+        self._dns_host = cached_resolve(host, self.port)
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+
+class CachedDNSHTTPConnection(_CachedDNSMixin, HTTPConnection):
+    pass
+
+
+class CachedDNSHTTPSConnection(_CachedDNSMixin, HTTPSConnection):
+    pass
+
+
+class CachedDNSHTTPPool(HTTPConnectionPool):
+    ConnectionCls = CachedDNSHTTPConnection
+
+
+class CachedDNSHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = CachedDNSHTTPSConnection
+
+
+class CachedDNSAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CachedDNSHTTPPool,
+            "https": CachedDNSHTTPSPool,
+        }
+
+
+# Session unique : keep-alive vers serpapi.com et vers les sites fetchés
+# (User-Agent posé dans main, depuis --user-agent)
+SESSION = requests.Session()
+_adapter = CachedDNSAdapter(pool_connections=32, pool_maxsize=64,
+                            max_retries=Retry(total=2, backoff_factor=0.3))
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+# politesse : au plus PER_HOST_LIMIT fetchs simultanés vers un même site
+PER_HOST_LIMIT = 4
+_host_sems: Dict[str, threading.Semaphore] = {}
+_host_sems_lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Espace les appels d'au moins `interval` secondes, tous threads confondus :
+    les workers attendent leur créneau au lieu de dormir après chaque ligne.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        time.sleep(at - now)
+
+
+# intervalle fixé dans main depuis --sleep
+SERPAPI_LIMITER = RateLimiter(1.2)
+
+# fetchs des pages d'une ligne en parallèle (créé dans main, dimensionné sur --workers)
+PAGE_POOL: Optional[ThreadPoolExecutor] = None
+
+
+def host_semaphore(url: str) -> threading.Semaphore:
+    host = urlparse(url).hostname or ""
+    with _host_sems_lock:
+        sem = _host_sems.get(host)
+        if sem is None:
+            sem = _host_sems[host] = threading.Semaphore(PER_HOST_LIMIT)
+    return sem
 
 
 @dataclass
@@ -46,6 +185,20 @@ def domain_from_email(email: str) -> str:
     return parts[1].lower().strip() if len(parts) == 2 else ""
 
 
+@functools.lru_cache(maxsize=1024)
+def _normalize_expected(expected_domain: str) -> str:
+    # même valeur pour tous les emails d'une ligne : calculé une fois
+    exp = expected_domain.lower().strip()
+    exp = exp.replace("http://", "").replace("https://", "").split("/", 1)[0]
+    return exp.removeprefix("www.")
+
+
+def site_root(expected_domain: str) -> str:
+    # hôte tel que fourni (www. compris : certains sites ne répondent que dessus)
+    host = re.sub(r"^https?://", "", expected_domain.strip(), flags=re.IGNORECASE)
+    return "https://" + host.split("/", 1)[0].lower()
+
+
 def score_email(email: str, expected_domain: Optional[str]) -> Tuple[int, str]:
     """
     Score simple et robuste.
@@ -56,23 +209,16 @@ def score_email(email: str, expected_domain: Optional[str]) -> Tuple[int, str]:
     e = normalize_email(email)
     dom = domain_from_email(e)
 
-    free = {
-        "gmail.com", "googlemail.com", "outlook.com", "hotmail.com", "live.com",
-        "yahoo.com", "yahoo.com.au", "icloud.com", "aol.com", "proton.me", "protonmail.com"
-    }
-
     localpart = e.split("@", 1)[0]
     score = 50
     reason = []
 
-    if dom in free:
+    if dom in FREE_DOMAINS:
         score -= 35
         reason.append("free_provider")
 
     if expected_domain:
-        exp = expected_domain.lower().strip()
-        exp = exp.replace("http://", "").replace("https://", "").split("/", 1)[0]
-        exp = exp.lstrip("www.")
+        exp = _normalize_expected(expected_domain)
         if dom == exp:
             score += 35
             reason.append("domain_match")
@@ -84,12 +230,10 @@ def score_email(email: str, expected_domain: Optional[str]) -> Tuple[int, str]:
             reason.append("domain_mismatch")
 
     # localpart preference
-    for i, lp in enumerate(LOCALPART_PRIORITY):
-        if localpart == lp:
-            bonus = max(0, 25 - i * 3)
-            score += bonus
-            reason.append(f"lp={lp}")
-            break
+    i = LOCALPART_INDEX.get(localpart)
+    if i is not None:
+        score += max(0, 25 - i * 3)
+        reason.append(f"lp={localpart}")
 
     score = max(0, min(100, score))
     return score, ",".join(reason) if reason else "generic"
@@ -111,9 +255,9 @@ def search_serpapi(query: str, api_key: str, timeout: int = 30, num: int = 5) ->
         "api_key": api_key,
         "num": num,
     }
-    r = requests.get("https://serpapi.com/search.json", params=params, timeout=timeout)
+    r = SESSION.get("https://serpapi.com/search.json", params=params, timeout=timeout)
     r.raise_for_status()
-    data = r.json()
+    data = orjson.loads(r.content) if orjson else r.json()
 
     urls = []
     for item in data.get("organic_results", [])[:num]:
@@ -123,16 +267,29 @@ def search_serpapi(query: str, api_key: str, timeout: int = 30, num: int = 5) ->
     return urls
 
 
-def fetch_page(url: str, timeout: int, ua: str) -> Optional[str]:
+def decode_body(body: bytes, encoding: Optional[str]) -> str:
+    # comme Response.text : charset inconnu (ex. "utf8mb4") => utf-8 avec remplacement
     try:
-        r = requests.get(url, headers={"User-Agent": ua}, timeout=timeout, allow_redirects=True)
-        if r.status_code >= 400:
-            return None
-        # évite de parser des pdf, images, etc.
-        ctype = (r.headers.get("content-type") or "").lower()
-        if "text/html" not in ctype and "text/plain" not in ctype:
-            return None
-        return r.text
+        return body.decode(encoding or "utf-8", errors="replace")
+    except (LookupError, TypeError):
+        return body.decode("utf-8", errors="replace")
+
+
+def fetch_page(url: str, timeout: int) -> Optional[str]:
+    try:
+        with host_semaphore(url), SESSION.get(url, timeout=timeout, allow_redirects=True, stream=True) as r:
+            if r.status_code >= 400:
+                return None
+            # évite de parser des pdf, images, etc. (avant d'avoir lu le corps)
+            ctype = (r.headers.get("content-type") or "").lower()
+            if "text/html" not in ctype and "text/plain" not in ctype:
+                return None
+            buf = bytearray()
+            for chunk in r.iter_content(65536):
+                buf += chunk
+                if len(buf) >= MAX_BODY:
+                    break
+            return decode_body(buf[:MAX_BODY], r.encoding)
     except Exception:
         return None
 
@@ -150,15 +307,10 @@ def build_query(legal_name: str, state: str = "", postcode: str = "") -> str:
     return f'"{name}" contact email'
 
 
-def read_input_rows(path: str, limit: int) -> List[dict]:
-    rows = []
+def read_input_rows(path: str, limit: int) -> Iterator[dict]:
+    # lecture en flux : on s'arrête à `limit` lignes sans lire le reste du fichier
     with open(path, "r", encoding="utf-8", errors="replace", newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            rows.append(row)
-            if limit and len(rows) >= limit:
-                break
-    return rows
+        yield from itertools.islice(csv.DictReader(f), limit or None)
 
 
 def write_output(path: str, results: List[dict]) -> None:
@@ -178,62 +330,85 @@ def write_output(path: str, results: List[dict]) -> None:
             w.writerow(r)
 
 
-def main():
-    ap = argparse.ArgumentParser(description="Search emails via SerpApi and extract from pages.")
-    ap.add_argument("--input", required=True, help="Input CSV (ABN bulk extract, etc.)")
-    ap.add_argument("--output", required=True, help="Output CSV")
-    ap.add_argument("--limit", type=int, default=100, help="Max rows to test")
-    ap.add_argument("--provider", default="serpapi", choices=["serpapi"], help="Search provider")
-    ap.add_argument("--timeout", type=int, default=20, help="HTTP timeout seconds")
-    ap.add_argument("--sleep", type=float, default=1.2, help="Sleep between searches (seconds)")
-    ap.add_argument("--links", type=int, default=2, help="Max result links to fetch per company")
-    ap.add_argument("--user-agent", default="Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121 Safari/537.36")
-    ap.add_argument("--expected-domain-field", default="", help="Optional CSV field containing a known domain/website")
-    args = ap.parse_args()
+def scan_pages(urls: List[str], expected_domain: Optional[str], timeout: int) -> Tuple[Optional[FoundEmail], bool]:
+    """
+    Fetch des pages en parallèle, dépouillées dans l'ordre de `urls`
+    (résultat indépendant de l'ordre d'arrivée). Dès qu'un email est très bon,
+    on annule les fetchs pas encore partis.
+    Retourne (meilleur email, au moins une page chargée).
+    """
+    futures = [PAGE_POOL.submit(fetch_page, u, timeout) for u in urls]
+    best: Optional[FoundEmail] = None
+    loaded = False
 
-    api_key = os.getenv("SERPAPI_API_KEY", "").strip()
-    if not api_key:
-        print("ERROR: SERPAPI_API_KEY is not set. Do: export SERPAPI_API_KEY='...'", file=sys.stderr)
-        sys.exit(2)
+    for i, (url, fut) in enumerate(zip(urls, futures)):
+        html = fut.result()
+        if not html:
+            continue
+        loaded = True
 
-    rows = read_input_rows(args.input, args.limit)
+        emails = extract_emails_from_text(html)
+        if not emails:
+            continue
 
-    results = []
-    tested = 0
-    found = 0
+        candidate = pick_best_email(emails, expected_domain=expected_domain, source_url=url)
+        if candidate and (best is None or candidate.confidence > best.confidence):
+            best = candidate
 
-    for row in rows:
-        tested += 1
+        # si c'est très bon, on stop
+        if best and best.confidence >= 85:
+            for f in futures[i + 1:]:
+                f.cancel()
+            break
 
-        abn = (row.get("abn") or "").strip()
-        legal_name = (row.get("legal_name") or row.get("business_name") or "").strip()
-        state = (row.get("main_state") or "").strip()
-        postcode = (row.get("main_postcode") or "").strip()
+    return best, loaded
 
-        expected_domain = None
-        if args.expected_domain_field:
-            expected_domain = (row.get(args.expected_domain_field) or "").strip() or None
 
-        if not legal_name:
-            # pas exploitable
-            results.append({
-                "abn": abn,
-                "legal_name": "",
-                "email": "",
-                "confidence": 0,
-                "source_url": "",
-                "reason": "missing_legal_name",
-                "query": "",
-            })
-            continue
+def process_row(row: dict, args, api_key: str) -> dict:
+    """
+    Une ligne d'entrée -> une ligne de sortie (recherche + fetch des pages).
+    Appelée en parallèle depuis main.
+    """
+    abn = (row.get("abn") or "").strip()
+    legal_name = (row.get("legal_name") or row.get("business_name") or "").strip()
+    state = (row.get("main_state") or "").strip()
+    postcode = (row.get("main_postcode") or "").strip()
+
+    expected_domain = None
+    if args.expected_domain_field:
+        expected_domain = (row.get(args.expected_domain_field) or "").strip() or None
+
+    if not legal_name:
+        # pas exploitable
+        return {
+            "abn": abn,
+            "legal_name": "",
+            "email": "",
+            "confidence": 0,
+            "source_url": "",
+            "reason": "missing_legal_name",
+            "query": "",
+        }
+
+    query = ""
+    best: Optional[FoundEmail] = None
+    loaded = False
+
+    if expected_domain:
+        # site déjà connu : pas d'appel SerpApi (payant, le plus lent), on crawle directement
+        site = site_root(expected_domain)
+        best, loaded = scan_pages([site + p for p in DIRECT_PAGES], expected_domain, args.timeout)
 
+    if not loaded:
+        # pas de domaine connu, ou aucune page du site n'a répondu : recherche
         query = build_query(legal_name, state, postcode)
 
         # 1) search
+        SERPAPI_LIMITER.wait()
         try:
             urls = search_serpapi(query, api_key=api_key, timeout=args.timeout, num=max(5, args.links))
         except Exception as e:
-            results.append({
+            return {
                 "abn": abn,
                 "legal_name": legal_name,
                 "email": "",
@@ -241,58 +416,72 @@ def main():
                 "source_url": "",
                 "reason": f"search_error:{type(e).__name__}",
                 "query": query,
-            })
-            time.sleep(args.sleep)
-            continue
+            }
 
         # 2) fetch a couple pages + extract
-        best: Optional[FoundEmail] = None
-        fetched = 0
+        best, _ = scan_pages(urls[:args.links], expected_domain, args.timeout)
+
+    if best:
+        return {
+            "abn": abn,
+            "legal_name": legal_name,
+            "email": best.email,
+            "confidence": best.confidence,
+            "source_url": best.source_url,
+            "reason": best.reason,
+            "query": query,
+        }
+    return {
+        "abn": abn,
+        "legal_name": legal_name,
+        "email": "",
+        "confidence": 0,
+        "source_url": "",
+        "reason": "not_found",
+        "query": query,
+    }
+
 
-        for url in urls:
-            if fetched >= args.links:
-                break
-            fetched += 1
+def main():
+    global PAGE_POOL
+    ap = argparse.ArgumentParser(description="Search emails via SerpApi and extract from pages.")
+    ap.add_argument("--input", required=True, help="Input CSV (ABN bulk extract, etc.)")
+    ap.add_argument("--output", required=True, help="Output CSV")
+    ap.add_argument("--limit", type=int, default=100, help="Max rows to test")
+    ap.add_argument("--provider", default="serpapi", choices=["serpapi"], help="Search provider")
+    ap.add_argument("--timeout", type=int, default=20, help="HTTP timeout seconds")
+    ap.add_argument("--sleep", type=float, default=1.2, help="Min interval between searches, across workers (seconds)")
+    ap.add_argument("--links", type=int, default=2, help="Max result links to fetch per company")
+    ap.add_argument("--workers", type=int, default=8, help="Rows processed in parallel")
+    ap.add_argument("--user-agent", default="Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121 Safari/537.36")
+    ap.add_argument("--expected-domain-field", default="", help="Optional CSV field containing a known domain/website")
+    args = ap.parse_args()
 
-            html = fetch_page(url, timeout=args.timeout, ua=args.user_agent)
-            if not html:
-                continue
+    api_key = os.getenv("SERPAPI_API_KEY", "").strip()
+    if not api_key:
+        print("ERROR: SERPAPI_API_KEY is not set. Do: export SERPAPI_API_KEY='...'", file=sys.stderr)
+        sys.exit(2)
 
-            emails = extract_emails_from_text(html)
-            if not emails:
-                continue
+    SESSION.headers.update({"User-Agent": args.user_agent})
+    SERPAPI_LIMITER.interval = args.sleep
 
-            candidate = pick_best_email(emails, expected_domain=expected_domain, source_url=url)
-            if candidate and (best is None or candidate.confidence > best.confidence):
-                best = candidate
+    rows = read_input_rows(args.input, args.limit)
 
-            # si c'est très bon, on stop
-            if best and best.confidence >= 85:
-                break
+    PAGE_POOL = ThreadPoolExecutor(max_workers=args.workers * len(DIRECT_PAGES))
 
-        if best:
-            found += 1
-            results.append({
-                "abn": abn,
-                "legal_name": legal_name,
-                "email": best.email,
-                "confidence": best.confidence,
-                "source_url": best.source_url,
-                "reason": best.reason,
-                "query": query,
-            })
-        else:
-            results.append({
-                "abn": abn,
-                "legal_name": legal_name,
-                "email": "",
-                "confidence": 0,
-                "source_url": "",
-                "reason": "not_found",
-                "query": query,
-            })
+    # lignes traitées en parallèle, au plus 4 x --workers en vol : le CSV est lu au fil
+    # de l'eau (map soumettrait tout d'un coup) ; la file garde l'ordre d'entrée en sortie
+    results = []
+    pending = deque()
+    with PAGE_POOL, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for row in rows:
+            if len(pending) >= args.workers * 4:
+                results.append(pending.popleft().result())
+            pending.append(pool.submit(process_row, row, args, api_key))
+        results.extend(fut.result() for fut in pending)
 
-        time.sleep(args.sleep)
+    tested = len(results)
+    found = sum(1 for r in results if r["email"])
 
     write_output(args.output, results)
     print(f"[done] tested={tested} found={found} output={args.output}")
@@ -300,6 +489,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
-